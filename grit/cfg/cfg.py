@@ -7,8 +7,27 @@
 
 import os
 import logging
+import tempfile
 
 # server settings
 GRIT_SERVER_PORT = os.environ.get('GRIT_SERVER_PORT', 8080)
 GRIT_LOG_LEVEL = os.environ.get('GRIT_LOG_LEVEL', logging.WARN)
 GRIT_STATIC_DIR = os.environ.get('GRIT_STATIC_DIR', os.path.join(os.path.dirname(__file__), '..', '..', 'static'))
+GRIT_GZIP_RESPONSE = bool(int(os.environ.get('GRIT_GZIP_RESPONSE', 1)))
+GRIT_GZIP_MIN_SIZE = int(os.environ.get('GRIT_GZIP_MIN_SIZE', 1024))
+
+# cache settings
+GRIT_TREE_CACHE_SIZE = int(os.environ.get('GRIT_TREE_CACHE_SIZE', 1000000))
+GRIT_VIEW_CACHE_SIZE = int(os.environ.get('GRIT_VIEW_CACHE_SIZE', 128))
+GRIT_STREAM_SIZE = int(os.environ.get('GRIT_STREAM_SIZE', 1 << 20))
+GRIT_UNPACK_LIMIT = int(os.environ.get('GRIT_UNPACK_LIMIT', 100))
+GRIT_REPO_POOL_SIZE = int(os.environ.get('GRIT_REPO_POOL_SIZE', 64))
+GRIT_BLOB_CACHE_DIR = os.environ.get('GRIT_BLOB_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'grit-blobs'))
+GRIT_BLOB_CACHE_SIZE = int(os.environ.get('GRIT_BLOB_CACHE_SIZE', 1 << 30))
+
+# proxy settings
+GRIT_PROXY_POOL_SIZE = int(os.environ.get('GRIT_PROXY_POOL_SIZE', 8))
+GRIT_PROXY_TIMEOUT = float(os.environ.get('GRIT_PROXY_TIMEOUT', 60))
+GRIT_PROXY_CACHE_DIR = os.environ.get('GRIT_PROXY_CACHE_DIR')
+GRIT_PROXY_CACHE_TTL = float(os.environ.get('GRIT_PROXY_CACHE_TTL', 0))
+GRIT_PROXY_CACHE_SIZE = int(os.environ.get('GRIT_PROXY_CACHE_SIZE', 1 << 26))
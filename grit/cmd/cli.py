@@ -136,5 +136,5 @@ def checkin(url, files, message=None):
     if message is None:
         message = 'Publishing %s' % ', '.join(files)
     if r.isLocal():
-        v.save(message=message)
+        v.save(message=message, pack=True)
     print
@@ -10,6 +10,9 @@ import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from proxy import *
+from graph import *
+from index import *
+from store import *
 from version import *
 from local import *
 from base import *
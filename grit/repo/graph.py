@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011-2012 Ryan Galloway (ryan@rsgalloway.com)
+#
+# This module is part of Grit and is released under
+# the BSD License: http://www.opensource.org/licenses/bsd-license.php
+
+import os
+import heapq
+import threading
+from collections import deque
+
+from dulwich.objects import Commit
+from dulwich.file import GitFile
+
+from grit.log import log
+
+__all__ = ['CommitGraph']
+
+# commit graph cache file, relative to the repo control dir
+GRAPH_FILE = os.path.join('info', 'grit', 'commits')
+
+class CommitGraph(object):
+    """
+    Topologically ordered list of the commits reachable from a head, oldest
+    first, so the last entry is always the head itself.
+
+    The graph is persisted in the repo control dir as one line per commit:
+
+        <sha> <commit time> <parent sha>,<parent sha>|-
+
+    The position of a commit in the graph is its version number, and both
+    directions of that mapping are constant time lookups.
+
+    When the head moves forward only the new commits are read from the object
+    store and appended to the file, so the full history is walked just once.
+    """
+
+    def __init__(self, repo, path=GRAPH_FILE):
+        """
+        Create a new CommitGraph instance.
+
+        :param repo: dulwich.repo.Repo instance.
+        :param path: Cache file path relative to the repo control dir, or None
+            to keep the graph in memory only.
+
+        :returns: CommitGraph instance.
+        """
+        self.repo = repo
+        if path is not None:
+            path = os.path.join(repo.controldir(), path)
+        self.path = path
+        self.ids = []
+        self.times = []
+        self.parents = []
+        self._index = {}
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return '<grit.CommitGraph "%s">' % self.head
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __getitem__(self, index):
+        return self.ids[index]
+
+    def __contains__(self, sha):
+        return sha in self._index
+
+    def index(self, sha):
+        """
+        Returns the position of a commit in the graph, i.e. its version number.
+
+        :param sha: Commit sha.
+
+        :raise: ValueError if the commit is not in the graph.
+        """
+        try:
+            return self._index[sha]
+        except KeyError:
+            raise ValueError(sha)
+
+    @property
+    def head(self):
+        """:return: sha of the newest commit in the graph"""
+        if self.ids:
+            return self.ids[-1]
+
+    def update(self, head='HEAD'):
+        """
+        Brings the graph up to date with head, reading only the commits that
+        are not in the graph yet.
+
+        :param head: Ref name or commit sha.
+
+        :returns: self
+
+        :raise: KeyError if head does not reference a commit.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            sha = self._resolve(head)
+            if sha == self.head:
+                return self
+
+            # walk back from head until we reach commits we already know
+            new = {}
+            boundary = set()
+            pending = deque([sha])
+            while pending:
+                sha = pending.popleft()
+                if sha in new:
+                    continue
+                if sha in self._index:
+                    boundary.add(sha)
+                    continue
+                commit = self.repo.object_store[sha]
+                if type(commit) != Commit:
+                    raise TypeError(commit)
+                new[sha] = commit
+                pending.extend(commit.parents)
+
+            # head moved forward: append, otherwise drop unreachable commits
+            if self.ids and boundary == set([self.head]):
+                self._save(self._extend(new))
+            else:
+                self._truncate(boundary)
+                self._extend(new)
+                self._save()
+            return self
+
+    def _resolve(self, head):
+        """:return: commit sha referenced by head"""
+        try:
+            return self.repo.refs[head]
+        except KeyError:
+            return self.repo[head].id
+
+    def _append(self, sha, commit_time, parents):
+        self._index[sha] = len(self.ids)
+        self.ids.append(sha)
+        self.times.append(commit_time)
+        self.parents.append(parents)
+
+    def _extend(self, commits):
+        """
+        Appends commits in topological order, oldest first when unrelated.
+
+        :param commits: Dict of sha to Commit, closed under parents except
+            for parents already in the graph.
+
+        :returns: List of appended shas.
+        """
+        waiting = {}
+        children = {}
+        for sha, commit in commits.items():
+            parents = [p for p in commit.parents if p in commits]
+            waiting[sha] = len(parents)
+            for parent in parents:
+                children.setdefault(parent, []).append(sha)
+        ready = [(commits[s].commit_time, s) for s, n in waiting.items() if n == 0]
+        heapq.heapify(ready)
+        added = []
+        while ready:
+            commit_time, sha = heapq.heappop(ready)
+            self._append(sha, commit_time, list(commits[sha].parents))
+            added.append(sha)
+            for child in children.get(sha, []):
+                waiting[child] -= 1
+                if waiting[child] == 0:
+                    heapq.heappush(ready, (commits[child].commit_time, child))
+        return added
+
+    def _truncate(self, heads):
+        """Keeps only the commits reachable from heads."""
+        position = self._index
+        keep = set()
+        pending = list(heads)
+        while pending:
+            sha = pending.pop()
+            if sha in keep or sha not in position:
+                continue
+            keep.add(sha)
+            pending.extend(self.parents[position[sha]])
+        entries = zip(self.ids, self.times, self.parents)
+        self.ids, self.times, self.parents = [], [], []
+        self._index = {}
+        for sha, commit_time, parents in entries:
+            if sha in keep:
+                self._append(sha, commit_time, parents)
+
+    def _load(self):
+        """Reads the graph from the cache file, if any."""
+        self._loaded = True
+        if self.path is None or not os.path.isfile(self.path):
+            return
+        try:
+            for line in open(self.path, 'rb'):
+                sha, commit_time, parents = line.split()
+                if sha in self._index:
+                    continue
+                parents = [] if parents == '-' else parents.split(',')
+                for parent in parents:
+                    if parent not in self._index:
+                        raise ValueError('unknown parent %s' % parent)
+                self._append(sha, int(commit_time), parents)
+        except (IOError, ValueError), e:
+            log.debug('Discarding commit graph %s: %s' % (self.path, e))
+            self.ids, self.times, self.parents = [], [], []
+            self._index = {}
+
+    def _save(self, added=None):
+        """
+        Writes the graph to the cache file.
+
+        :param added: List of shas to append, or None to rewrite the file.
+        """
+        if self.path is None:
+            return
+        if added is None:
+            entries = range(len(self.ids))
+        else:
+            entries = range(len(self.ids) - len(added), len(self.ids))
+        lines = ['%s %d %s\n' % (self.ids[i], self.times[i],
+                 ','.join(self.parents[i]) or '-') for i in entries]
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            if added is None:
+                f = GitFile(self.path, 'wb')
+            else:
+                f = open(self.path, 'ab')
+            try:
+                f.write(''.join(lines))
+            finally:
+                f.close()
+        except (IOError, OSError), e:
+            log.debug('Could not write commit graph %s: %s' % (self.path, e))
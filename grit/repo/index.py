@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011-2012 Ryan Galloway (ryan@rsgalloway.com)
+#
+# This module is part of Grit and is released under
+# the BSD License: http://www.opensource.org/licenses/bsd-license.php
+
+import bisect
+import threading
+from array import array
+from collections import OrderedDict
+
+from dulwich.objects import hex_to_sha, sha_to_hex
+
+from grit.util import is_tree
+from grit.cfg import GRIT_TREE_CACHE_SIZE, GRIT_VIEW_CACHE_SIZE
+
+__all__ = ['TreeIndex', 'ResolvedView', 'get_index', 'get_view', 'cached_view',
+           'lookup_path', 'regex_prefix']
+
+# regex characters that end the literal part of a path pattern
+REGEX_CHARS = '.^$*+?{}[]\\|()'
+
+class TreeIndex(object):
+    """
+    Flattened index of every entry below a tree, sorted by path relative to
+    the tree, so exact and prefix lookups are binary searches.
+
+    Paths are kept in a sorted list, modes in an array and shas as one
+    packed string of binary shas.
+    """
+
+    def __init__(self, store, sha):
+        """
+        Create a new TreeIndex instance by walking all the trees below sha.
+
+        :param store: Object store.
+        :param sha: Tree sha.
+
+        :returns: TreeIndex instance.
+        """
+        self.sha = sha
+        entries = []
+        pending = [('', sha)]
+        while pending:
+            base, tree_sha = pending.pop()
+            for name, mode, child in store[tree_sha].iteritems():
+                path = base + name
+                entries.append((path, mode, hex_to_sha(child)))
+                if is_tree(mode):
+                    pending.append((path + '/', child))
+        entries.sort()
+        self.paths = [e[0] for e in entries]
+        self.modes = array('L', [e[1] for e in entries])
+        self.shas = ''.join([e[2] for e in entries])
+
+    def __repr__(self):
+        return '<grit.TreeIndex "%s" [%d]>' % (self.sha, len(self))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        for i in xrange(len(self.paths)):
+            yield self._entry(i)
+
+    def _entry(self, i):
+        return (self.paths[i], int(self.modes[i]), sha_to_hex(self.shas[i*20:i*20+20]))
+
+    def lookup(self, path):
+        """
+        Returns the entry at path.
+
+        :param path: Path relative to the indexed tree.
+
+        :return: Tuple of (mode, sha) or None.
+        """
+        i = bisect.bisect_left(self.paths, path)
+        if i < len(self.paths) and self.paths[i] == path:
+            return self._entry(i)[1:]
+        return None
+
+    def prefix(self, prefix):
+        """
+        Generator that yields the entries whose path starts with prefix.
+
+        :param prefix: Path prefix relative to the indexed tree.
+
+        :return: Tuples of (path, mode, sha).
+        """
+        i = bisect.bisect_left(self.paths, prefix)
+        while i < len(self.paths) and self.paths[i].startswith(prefix):
+            yield self._entry(i)
+            i += 1
+
+class ResolvedView(object):
+    """
+    Merged index of the trees along a branch inheritance chain, in which each
+    path resolves to the entry of the nearest tree that has it.
+
+    Entries are stored as the level and offset of the entry in the TreeIndex
+    of that level, so the view shares its storage with the tree indexes.
+    """
+
+    def __init__(self, indexes):
+        """
+        Create a new ResolvedView instance.
+
+        :param indexes: List of TreeIndex instances or None, nearest first.
+
+        :returns: ResolvedView instance.
+        """
+        self.indexes = indexes
+        merged = {}
+        for level, index in enumerate(indexes):
+            if index is None:
+                continue
+            for i, path in enumerate(index.paths):
+                if path not in merged:
+                    merged[path] = (level, i)
+        self.paths = sorted(merged)
+        self.levels = array('B', [merged[p][0] for p in self.paths])
+        self.offsets = array('L', [merged[p][1] for p in self.paths])
+
+    def __repr__(self):
+        return '<grit.ResolvedView [%d]>' % len(self)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        for i in xrange(len(self.paths)):
+            yield self._entry(i)
+
+    def _entry(self, i):
+        level = self.levels[i]
+        return (level,) + self.indexes[level]._entry(self.offsets[i])
+
+    def lookup(self, path):
+        """
+        Returns the entry at path.
+
+        :param path: Item path.
+
+        :return: Tuple of (level, path, mode, sha) or None.
+        """
+        i = bisect.bisect_left(self.paths, path)
+        if i < len(self.paths) and self.paths[i] == path:
+            return self._entry(i)
+        return None
+
+    def prefix(self, prefix):
+        """
+        Generator that yields the entries whose path starts with prefix.
+
+        :param prefix: Path prefix.
+
+        :return: Tuples of (level, path, mode, sha).
+        """
+        i = bisect.bisect_left(self.paths, prefix)
+        while i < len(self.paths) and self.paths[i].startswith(prefix):
+            yield self._entry(i)
+            i += 1
+
+_cache = OrderedDict()
+_cache_size = [0]
+_cache_lock = threading.Lock()
+
+def get_index(store, sha):
+    """
+    Returns the TreeIndex for a tree, from the process wide cache if it has
+    already been built. Least recently used indexes are evicted once the
+    cache holds more than GRIT_TREE_CACHE_SIZE entries in total.
+
+    :param store: Object store.
+    :param sha: Tree sha.
+
+    :return: TreeIndex instance.
+    """
+    with _cache_lock:
+        index = _cache.pop(sha, None)
+        if index is not None:
+            _cache[sha] = index
+            return index
+    index = TreeIndex(store, sha)
+    with _cache_lock:
+        if sha not in _cache:
+            _cache[sha] = index
+            _cache_size[0] += len(index)
+        while _cache_size[0] > GRIT_TREE_CACHE_SIZE and len(_cache) > 1:
+            _sha, _index = _cache.popitem(last=False)
+            _cache_size[0] -= len(_index)
+    return index
+
+_views = OrderedDict()
+_views_lock = threading.Lock()
+
+def get_view(key, indexes):
+    """
+    Returns the ResolvedView for key from the process wide cache, building
+    it if needed. At most GRIT_VIEW_CACHE_SIZE views are kept.
+
+    :param key: Hashable key, e.g. the head shas along the chain.
+    :param indexes: Callable returning the list of TreeIndex instances.
+
+    :return: ResolvedView instance.
+    """
+    with _views_lock:
+        view = _views.pop(key, None)
+        if view is not None:
+            _views[key] = view
+            return view
+    view = ResolvedView(indexes())
+    with _views_lock:
+        _views[key] = view
+        while len(_views) > GRIT_VIEW_CACHE_SIZE:
+            _views.popitem(last=False)
+    return view
+
+def cached_view(key):
+    """
+    Returns the ResolvedView for key if it is in the cache, without
+    building it.
+
+    :param key: Hashable key, see get_view().
+
+    :return: ResolvedView instance or None.
+    """
+    with _views_lock:
+        view = _views.pop(key, None)
+        if view is not None:
+            _views[key] = view
+        return view
+
+def lookup_path(store, sha, path):
+    """
+    Returns the entry at path below a tree, using the cached TreeIndex if
+    there is one, otherwise reading only the trees along the path.
+
+    :param store: Object store.
+    :param sha: Tree sha.
+    :param path: Path relative to the tree.
+
+    :return: Tuple of (mode, sha) or None.
+    """
+    index = _cache.get(sha)
+    if index is not None:
+        return index.lookup(path)
+    mode = None
+    for name in path.strip('/').split('/'):
+        if mode is not None and not is_tree(mode):
+            return None
+        try:
+            mode, sha = store[sha][name]
+        except KeyError:
+            return None
+    return mode, sha
+
+def regex_prefix(pattern):
+    """
+    Returns the literal leading part of a path regex, which every path the
+    pattern matches must start with.
+
+    :param pattern: Regex string.
+
+    :return: Literal prefix string.
+    """
+    if '|' in pattern:
+        return ''
+    for i, c in enumerate(pattern):
+        if c in REGEX_CHARS:
+            # quantifiers make the preceding character optional
+            if c in '*?{' and i:
+                return pattern[:i-1]
+            return pattern[:i]
+    return pattern
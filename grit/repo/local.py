@@ -9,21 +9,27 @@ import os
 import re
 import time
 import tempfile
+import threading
 import traceback
 from datetime import datetime
+from collections import OrderedDict
 
 from dulwich.repo import Repo
 from dulwich.objects import Blob, Tree, Commit
 
 from grit.repo import Proxy
-from grit.repo import Item, Version
-from grit.util import touch, is_git_dir
+from grit.repo import CommitGraph
+from grit.repo import get_view, cached_view, regex_prefix
+from grit.repo import Item, Version, Versions
+from grit.util import touch, is_git_dir, ref_stamp
 from grit.util import serialize, deserialize
 from grit.cmd import Git
 from grit.exc import *
 from grit.log import log
+from grit.cfg import GRIT_REPO_POOL_SIZE
 
-__all__ = ['is_repo', 'get_repos', 'get_repo_parent', 'Local']
+__all__ = ['is_repo', 'get_repos', 'get_repo_parent', 'Local', 'RepoPool', 'repo_pool',
+           'RepoResolver', 'repo_resolver', 'RepoCatalog', 'repo_catalog']
 
 def is_repo(path):
     """:return: True if path is a valid repository"""
@@ -45,22 +51,37 @@ def get_repos(path):
             ret.append(Local(pd))
     return ret
 
-def get_repo_parent(path):
+def get_repo_parent(path, pool=None):
     """
     Returns parent repo or input path if none found.
 
+    :param path: Repo or item path.
+    :param pool: RepoPool to get the repo from, instead of opening it.
+
     :return: grit.Local or path
     """
+    open_repo = pool.get if pool else Local
+
+    # path is known to be in a repository
+    root = repo_resolver.resolve(path)
+    if root is not None:
+        try:
+            return open_repo(root)
+        except RepoError:
+            repo_resolver.remove(root)
+
     # path is a repository
     if is_repo(path):
-        return Local(path)
+        repo_resolver.add(path)
+        return open_repo(path)
 
     # path is inside a repository
     elif not os.path.isdir(path):
         _rel = ''
         while path and path != '/':
             if is_repo(path):
-                return Local(path)
+                repo_resolver.add(path)
+                return open_repo(path)
             else:
                 _rel = os.path.join(os.path.basename(path), _rel)
                 path = os.path.dirname(path)
@@ -101,11 +122,14 @@ class Local(Repo):
             raise RepoError('Invalid path: %s' % path)
 
         super(Local, self).__init__(self.git_dir)
+        self._graph = CommitGraph(self)
+        self._stamp = None
+        self._head_version = None
+        self._parent = None
+        self._parent_checked = False
         self.name = os.path.basename(path)
         self.path = path
         self.abspath = os.path.abspath(self.path)
-        self.user = self.author
-        self.comment = self.message
         self.type = "local"
         self.is_bare = self.bare
 
@@ -116,15 +140,44 @@ class Local(Repo):
         return '<grit.Local "%s">' % self.path
 
     def __getattr__(self, key, *args, **kwargs):
-        return getattr(self.versions(-1), key, None)
+        return getattr(self._head(), key, None)
+
+    @property
+    def user(self):
+        """:return: author of the HEAD version"""
+        return self.author
+
+    @property
+    def comment(self):
+        """:return: message of the HEAD version"""
+        return self.message
+
+    def _history(self):
+        """:return: CommitGraph of HEAD, updated only when the ref changes"""
+        stamp = ref_stamp(self.git_dir)
+        if stamp is None or stamp != self._stamp:
+            self._graph.update()
+            self._stamp = stamp
+        return self._graph
+
+    def _head(self):
+        """:return: memoised HEAD Version, re-read only when the ref changes"""
+        try:
+            head = self._history().head
+        except Exception, e:
+            return []
+        if self._head_version is None or self._head_version.id != head:
+            self._head_version = Version(self, self.object_store[head])
+        return self._head_version
 
     def _get_parent(self):
-        """:return: Remote origin as Proxy instance"""
-        _dir = os.path.dirname(self.path)
-        if is_repo(_dir):
-            return Local(_dir)
-        else:
-            return None
+        """:return: Parent repo as Local instance, looked up once"""
+        if not self._parent_checked:
+            _dir = os.path.dirname(self.path)
+            if is_repo(_dir):
+                self._parent = Local(_dir)
+            self._parent_checked = True
+        return self._parent
 
     def _set_parent(self):
         raise NotImplementedError
@@ -171,32 +224,18 @@ class Local(Repo):
     def _commits(self, head='HEAD'):
         """Returns a list of the commits reachable from head.
 
-        :return: List of commit objects. the first of which will be the commit
-        of head, then following theat will be the parents.
+        :return: List of commit objects, ordered oldest to newest, the last of
+        which will be the commit of head.
 
         :raise: RepoError if any no commits are referenced, including if the
         head parameter isn't the sha of a commit.
         """
-        pending_commits = [head]
-        history = []
-        while pending_commits != []:
-            head = pending_commits.pop(0)
-            try:
-                commit = self[head]
-            except KeyError:
-                raise KeyError(head)
-            if type(commit) != Commit:
-                raise TypeError(commit)
-            if commit in history:
-                continue
-            i = 0
-            for known_commit in history:
-                if known_commit.commit_time > commit.commit_time:
-                    break
-                i += 1
-            history.insert(i, commit)
-            pending_commits += commit.parents
-        return history
+        if head == 'HEAD':
+            graph = self._graph
+        else:
+            graph = CommitGraph(self, path=None)
+        graph.update(head)
+        return [self.object_store[sha] for sha in graph]
 
     def versions(self, version=None):
         """
@@ -205,19 +244,19 @@ class Local(Repo):
         :param version: Version index.
         :param rev: Commit sha or ref.
 
-        :return: List of Version objects matching params.
+        :return: Lazy sequence of Version objects, or the Version at index.
         """
         try:
-            versions = [Version(self, c) for c in self._commits()]
+            graph = self._history()
         except Exception, e:
             log.debug('No versions exist')
             return []
-        if version is not None and versions:
+        if version is not None:
             try:
-                versions = versions[version]
+                return Version(self, self.object_store[graph[version]])
             except IndexError:
                 raise VersionError('Version %s does not exist' % version)
-        return versions
+        return Versions(self, graph.ids[:])
 
     def getDescription(self):
         """:returns: repository description"""
@@ -241,6 +280,8 @@ class Local(Repo):
 
     def delete(self):
         os.system('rm -rf %s' % self.abspath)
+        repo_pool.discard(self.abspath)
+        repo_resolver.remove(self.abspath)
 
     @classmethod
     def new(self, path, desc=None, bare=True):
@@ -266,6 +307,7 @@ class Local(Repo):
                 repo.setDescription(desc)
             version = repo.addVersion()
             version.save('Repo Initialization')
+            repo_resolver.add(repo.abspath)
             return repo
         except Exception, e:
             traceback.print_exc()
@@ -298,8 +340,113 @@ class Local(Repo):
         except VersionError, e:
             raise RepoError(e)
 
-    def iteritems(self):
-        pass
+    def addItems(self, items, message=None):
+        """
+        Add a list of Item class objects as a single new version, writing the
+        new objects to one pack file if there are many of them.
+
+        :param items: List of Item class objects.
+        :param message: Commit message.
+        """
+        if message is None:
+            message = 'Adding %d items' % len(items)
+        try:
+            v = Version.new(repo=self)
+            for item in items:
+                v.addItem(item)
+            v.save(message, pack=True)
+        except VersionError, e:
+            raise RepoError(e)
+
+    def _view(self):
+        """
+        Returns the resolved view of the latest items along the parent chain,
+        cached by the head shas of the chain.
+
+        :return: Tuple of (list of head Versions, ResolvedView).
+        """
+        versions, key = self._chain()
+        view = get_view(key, lambda: [v._tree_index() if v else None for v in versions])
+        return versions, view
+
+    def _chain(self):
+        """
+        Returns the head versions along the parent chain, nearest first.
+
+        :return: Tuple of (list of head Versions, view cache key).
+        """
+        chain, repo = [], self
+        while repo:
+            chain.append(repo)
+            repo = repo.parent
+        versions = [r._head() for r in chain]
+        key = tuple([(r.git_dir, getattr(v, 'id', None)) for r, v in zip(chain, versions)])
+        return versions, key
+
+    def iteritems(self, path=None, version=None):
+        """
+        Generator that yields the items of a version of this repo, followed by
+        the latest items of the parent repos that are not overridden.
+
+        :param path: Regex filter on item path.
+        :param version: Repo versions number/index.
+
+        :return: Item class objects.
+        """
+        if version in (None, -1):
+            versions, view = self._view()
+            if path is None:
+                entries = iter(view)
+            else:
+                regex = re.compile(path + '$')
+                entries = (e for e in view.prefix(regex_prefix(path)) if regex.match(e[1]))
+            for level, p, mode, sha in entries:
+                yield Item(versions[level], sha, p, mode)
+            raise StopIteration
+
+        seen = set()
+        repo, v = self, self.versions(version)
+        while repo:
+            if v:
+                if path is None:
+                    items = v.iteritems()
+                else:
+                    items = v.items(path=path)
+                for item in items:
+                    if item.path not in seen:
+                        seen.add(item.path)
+                        yield item
+
+            # get latest committed items from parents
+            repo = repo.parent
+            if repo:
+                v = repo.versions(-1)
+
+    def getItem(self, path):
+        """
+        Returns the latest item at path along the parent chain. Only the path
+        is resolved, the item data is not read. The resolved view is used if
+        it is cached, otherwise only the trees along the path are read, one
+        repo at a time, until the path is found.
+
+        :param path: Item path.
+
+        :return: Item class object or None.
+        """
+        path = path.strip('/')
+        versions, key = self._chain()
+        view = cached_view(key)
+        if view is not None:
+            entry = view.lookup(path)
+            if entry is None:
+                return None
+            level, p, mode, sha = entry
+            return Item(versions[level], sha, p, mode)
+        for v in versions:
+            item = v.getItem(path) if v and path else None
+            if item is not None:
+                return item
+        return None
 
     #TODO: move path arg to iteritems, items() returns only local items
     def items(self, path=None, version=None):
@@ -311,27 +458,7 @@ class Local(Repo):
 
         :return: List of Item class objects.
         """
-        if version is None:
-            version = -1
-        items = {}
-        for item in self.versions(version).items():
-            items[item.path] = item
-        parent = self.parent
-
-        # get latest committed items from parents
-        while parent:
-            for item in parent.items(path=path):
-                if item.path not in items.keys():
-                    items[item.path] = item
-            parent = parent.parent
-
-        # filter items matching path regex
-        if path is not None:
-            path += '$'
-            regex = re.compile(path)
-            return [item for path, item in items.items() if regex.match(path)]
-        else:
-            return items.values()
+        return list(self.iteritems(path=path, version=version))
 
     def addSubmodule(self, url, name=None, path=None):
         raise NotImplementedError
@@ -348,13 +475,307 @@ class Local(Repo):
     def push(self):
         self.git.push('origin', 'master')
 
-    def serialize(self):
+    def serialize(self, fields=None):
         d = self.__dict__
-        d['desc'] = self.getDescription()
-        d['date'] = self.date
-        if self.parent and self.parent.repo:
-            d['parent'] = self.parent.repo.name
-        return serialize(d)
+        if fields is None or 'user' in fields:
+            d['user'] = self.user
+        if fields is None or 'comment' in fields:
+            d['comment'] = self.comment
+        if fields is None or 'desc' in fields:
+            d['desc'] = self.getDescription()
+        if fields is None or 'date' in fields:
+            d['date'] = self.date
+        if fields is None or 'parent' in fields:
+            if self.parent and self.parent.repo:
+                d['parent'] = self.parent.repo.name
+        return serialize(d, fields)
 
     def deserialize(self, params):
         deserialize(self, params)
+
+class RepoPool(object):
+    """
+    Pool of open Local repo handles keyed by repo path, so requests reuse
+    the parsed pack indexes, commit graph and head version of a repo
+    instead of opening it again.
+
+    dulwich reads pack data with seek and read on a shared file, so a handle
+    is only ever used by the thread that opened it: each thread has its own
+    least recently used set of at most size handles. Handles follow ref
+    changes themselves, and are replaced if their repo dir is removed or
+    recreated.
+    """
+
+    def __init__(self, size=GRIT_REPO_POOL_SIZE):
+        """
+        Create a new RepoPool instance.
+
+        :param size: Max number of handles kept per thread.
+
+        :returns: RepoPool instance.
+        """
+        self.size = size
+        self._local = threading.local()
+
+    def __repr__(self):
+        return '<grit.RepoPool [%d]>' % len(self._handles())
+
+    def _handles(self):
+        """:return: OrderedDict of path to (stamp, Local) of this thread"""
+        handles = getattr(self._local, 'handles', None)
+        if handles is None:
+            handles = self._local.handles = OrderedDict()
+        return handles
+
+    def get(self, path):
+        """
+        Returns an open handle to the repo at path.
+
+        :param path: Repo path.
+
+        :return: Local instance.
+
+        :raise: RepoError if path is not a repo.
+        """
+        path = os.path.abspath(path)
+        handles = self._handles()
+        entry = handles.pop(path, None)
+        try:
+            st = os.stat(path)
+            stamp = (st.st_dev, st.st_ino)
+        except OSError:
+            raise RepoError('Invalid path: %s' % path)
+        if entry is None or entry[0] != stamp:
+            entry = (stamp, Local(path))
+        handles[path] = entry
+        while len(handles) > self.size:
+            handles.popitem(last=False)
+        return entry[1]
+
+    def discard(self, path):
+        """Drops the handle to the repo at path held by this thread."""
+        self._handles().pop(os.path.abspath(path), None)
+
+    def clear(self):
+        """Drops all the handles held by this thread."""
+        self._handles().clear()
+
+# process wide repo pool used by the servers
+repo_pool = RepoPool()
+
+class _Node(object):
+    """RepoResolver trie node for one path component."""
+    __slots__ = ('children', 'repo', 'mtime')
+
+    def __init__(self):
+        self.children = {}
+        self.repo = False
+        self.mtime = None
+
+class RepoResolver(object):
+    """
+    Memoised resolution of paths to the repos that contain them.
+
+    Known repo roots are kept in a trie of path components. When a repo is
+    passed through, its dir is listed to add the branches below it, and
+    listed again only when the dir mtime changes, so paths below known
+    repos resolve with one stat per repo level. Branches created by other
+    processes show up on the next lookup.
+    """
+
+    def __init__(self):
+        """
+        Create a new RepoResolver instance.
+
+        :returns: RepoResolver instance.
+        """
+        self._root = _Node()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<grit.RepoResolver>'
+
+    def _parts(self, path):
+        return [p for p in os.path.abspath(path).split(os.sep) if p]
+
+    def _scan(self, node, path):
+        """Syncs the branches of a repo node with its dir, if it changed."""
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return
+        if mtime == node.mtime:
+            return
+        node.mtime = mtime
+        try:
+            names = set(os.listdir(path))
+        except OSError:
+            return
+        for name, child in node.children.items():
+            if child.repo and name not in names:
+                del node.children[name]
+        for name in names:
+            child = node.children.get(name)
+            if (child is None or not child.repo) and is_repo(os.path.join(path, name)):
+                child = node.children.setdefault(name, _Node())
+                child.repo = True
+
+    def resolve(self, path):
+        """
+        Returns the root of the nearest known repo containing path.
+
+        :param path: Repo or item path.
+
+        :return: Repo path, or None if path is not in a known repo.
+        """
+        parts = self._parts(path)
+        found = None
+        with self._lock:
+            node = self._root
+            for i, part in enumerate(parts):
+                if node.repo:
+                    self._scan(node, os.sep + os.path.join(*parts[:i]))
+                node = node.children.get(part)
+                if node is None:
+                    break
+                if node.repo:
+                    found = i + 1
+        if found is None:
+            return None
+        return os.sep + os.path.join(*parts[:found])
+
+    def add(self, path):
+        """Adds a repo root to the trie."""
+        with self._lock:
+            node = self._root
+            for part in self._parts(path):
+                node = node.children.setdefault(part, _Node())
+            node.repo = True
+
+    def remove(self, path):
+        """Removes a repo root, and any repo below it, from the trie."""
+        parts = self._parts(path)
+        if not parts:
+            return
+        with self._lock:
+            node = self._root
+            for part in parts[:-1]:
+                node = node.children.get(part)
+                if node is None:
+                    return
+            node.children.pop(parts[-1], None)
+
+# process wide path to repo resolver
+repo_resolver = RepoResolver()
+
+class RepoCatalog(object):
+    """
+    Cached listing of the repos in a directory, with summary fields for
+    each repo, so listings do not open every repo in the directory.
+
+    A directory is listed again when its mtime changes, and the summary of
+    a repo is read again when its head ref or description changes.
+    """
+
+    def __init__(self):
+        """
+        Create a new RepoCatalog instance.
+
+        :returns: RepoCatalog instance.
+        """
+        self._dirs = {}
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<grit.RepoCatalog [%d]>' % len(self._dirs)
+
+    def _stamp(self, path):
+        """:return: Tuple of the head ref and description stamps of a repo"""
+        try:
+            desc = os.stat(os.path.join(path, 'description')).st_mtime
+        except OSError:
+            desc = None
+        return ref_stamp(path), desc
+
+    def _names(self, path):
+        """:return: Names of the repos in path, listed again when it changes"""
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return []
+        with self._lock:
+            entry = self._dirs.get(path)
+        if entry is None or entry[0] != mtime:
+            names = sorted([d for d in os.listdir(path) if is_repo(os.path.join(path, d))])
+            entry = (mtime, names)
+            with self._lock:
+                self._dirs[path] = entry
+                # forget the repos that are gone
+                for key in self._summaries.keys():
+                    if os.path.dirname(key) == path and os.path.basename(key) not in names:
+                        del self._summaries[key]
+        return entry[1]
+
+    def summary(self, path):
+        """
+        Returns the summary of a repo: name, path, type, desc, head sha,
+        date, user, comment and parent name.
+
+        :param path: Repo path.
+
+        :return: Dict of serialized summary fields.
+        """
+        path = os.path.abspath(path)
+        stamp = self._stamp(path)
+        with self._lock:
+            entry = self._summaries.get(path)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        repo = Local(path)
+        head = repo._head()
+        d = {
+            'name': repo.name,
+            'path': repo.path,
+            'abspath': repo.abspath,
+            'type': repo.type,
+            'is_bare': repo.is_bare,
+            'desc': repo.getDescription(),
+            'head': getattr(head, 'id', None),
+            'date': repo.date,
+            'user': repo.user,
+            'comment': repo.comment,
+        }
+        if repo.parent and repo.parent.repo:
+            d['parent'] = repo.parent.repo.name
+        d = serialize(d)
+        with self._lock:
+            self._summaries[path] = (stamp, d)
+        return d
+
+    def list(self, path, offset=0, limit=None):
+        """
+        Returns the summaries of the repos in a directory, sorted by name.
+
+        :param path: Directory path.
+        :param offset: Index of the first repo to return.
+        :param limit: Max number of repos to return.
+
+        :return: List of dicts of serialized summary fields.
+        """
+        path = os.path.abspath(str(path))
+        names = self._names(path)
+        stop = None if limit is None else offset + limit
+        if offset < 0 and stop is not None and stop >= 0:
+            stop = None
+        names = names[offset:stop]
+        ret = []
+        for name in names:
+            try:
+                ret.append(dict(self.summary(os.path.join(path, name))))
+            except RepoError, e:
+                log.debug('Skipping repo %s: %s' % (name, e))
+        return ret
+
+# process wide repo listing cache
+repo_catalog = RepoCatalog()
@@ -6,31 +6,312 @@
 # the BSD License: http://www.opensource.org/licenses/bsd-license.php
 
 import os
+import time
+import Queue
+import socket
+import httplib
+import zlib
+import urlparse
+import tempfile
+import threading
 import simplejson as json
-from urllib import urlopen
+from hashlib import sha1
 from urllib import urlencode
 from datetime import datetime
+from collections import OrderedDict
 
 from grit.exc import *
 from grit.log import log
+from grit.cfg import GRIT_PROXY_POOL_SIZE, GRIT_PROXY_TIMEOUT
+from grit.cfg import GRIT_PROXY_CACHE_DIR, GRIT_PROXY_CACHE_TTL, GRIT_PROXY_CACHE_SIZE
 
 # -----------------------------------------------------------------------------
+def decode_body(data, coding):
+    """
+    Decodes a gzip or deflate encoded response body.
+
+    :param data: Response body.
+    :param coding: Content-Encoding response header value, or None.
+
+    :return: Decoded data string.
+    """
+    if coding == 'gzip':
+        return zlib.decompress(data, zlib.MAX_WBITS | 16)
+    elif coding == 'deflate':
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            # some servers send raw deflate data without the zlib header
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+    return data
+
+# params sent as raw form values, e.g. binary file data, not JSON encoded
+RAW_PARAMS = ('filedata',)
+
+# actions that only read, so they can be sent again
+READ_ACTIONS = ('read', 'items', 'versions', 'repos', 'tags', 'submodules', 'parent', 'data')
+
+class ConnectionPool(object):
+    """
+    Pool of persistent HTTP/1.1 connections keyed by scheme and host, shared
+    by all Proxy instances, so consecutive requests to a server reuse one
+    keep-alive connection instead of opening a new one each.
+
+    A connection is used by one request at a time, and goes back to the
+    pool once its response has been read.
+    """
+
+    def __init__(self, size=GRIT_PROXY_POOL_SIZE, timeout=GRIT_PROXY_TIMEOUT):
+        """
+        Create a new ConnectionPool instance.
+
+        :param size: Max number of idle connections kept per host.
+        :param timeout: Socket timeout in seconds.
+
+        :returns: ConnectionPool instance.
+        """
+        self.size = size
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<grit.ConnectionPool [%d]>' % sum([len(c) for c in self._idle.values()])
+
+    def _get(self, key):
+        """:return: Tuple of (connection, True if it was idle in the pool)"""
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        scheme, host = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, timeout=self.timeout), False
+        return httplib.HTTPConnection(host, timeout=self.timeout), False
+
+    def _put(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, url, body=None, headers={}, timeout=None, retry=False):
+        """
+        Sends a request over a pooled connection.
+
+        :param method: HTTP method.
+        :param url: HTTP URL.
+        :param body: Request body.
+        :param headers: Dict of request headers.
+        :param timeout: Socket timeout in seconds for this request, instead
+            of the pool timeout.
+        :param retry: The request is safe to repeat, so it is sent again on
+            another connection if an idle connection turns out to have been
+            closed by the server. Other requests are never sent twice.
+
+        :return: Tuple of (status, dict of lowercase response headers, body).
+
+        :raise: httplib.HTTPException or socket.error.
+        """
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        while True:
+            conn, reused = self._get(key)
+            conn.timeout = self.timeout if timeout is None else timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(conn.timeout)
+            sent = False
+            try:
+                conn.request(method, path, body, headers)
+                sent = True
+                response = conn.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                # the server may have closed an idle connection, either
+                # while sending or without answering at all
+                closed = not sent or (isinstance(e, httplib.BadStatusLine)
+                                      and (e.line in ('', "''") or e.line.startswith('No status line')))
+                if retry and reused and closed and not isinstance(e, socket.timeout):
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._put(key, conn)
+            return response.status, dict(response.getheaders()), data
+
+    def clear(self):
+        """Closes all the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+# connection pool shared by all proxies
+connection_pool = ConnectionPool()
+
+class ResponseCache(object):
+    """
+    Cache of proxy responses keyed by url and request params, kept in memory
+    and, if a path is given, on disk so it is shared between processes.
+
+    Responses are stored with the ETag the server sent them with, and are
+    revalidated with If-None-Match, so an unchanged response costs a round
+    trip without a body. Within ttl seconds of being stored or revalidated,
+    an entry is used without asking the server at all.
+
+    The least recently used entries are dropped from memory once they add
+    up to more than size bytes. With no size and no path the cache is
+    disabled.
+    """
+
+    def __init__(self, path=GRIT_PROXY_CACHE_DIR, ttl=GRIT_PROXY_CACHE_TTL,
+                 size=GRIT_PROXY_CACHE_SIZE):
+        """
+        Create a new ResponseCache instance.
+
+        :param path: Cache directory, or None to cache in memory only.
+        :param ttl: Seconds an entry is used without revalidation.
+        :param size: Max total size in bytes of the entries kept in memory,
+            0 to keep none.
+
+        :returns: ResponseCache instance.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.size = size
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<grit.ResponseCache [%d]>' % len(self._entries)
+
+    @property
+    def enabled(self):
+        """:return: True if responses are cached in memory or on disk"""
+        return self.size > 0 or self.path is not None
+
+    def key(self, url, params):
+        """:return: Cache key for a request"""
+        return sha1(url + '\0' + urlencode(sorted(params.items()))).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, key):
+        """
+        Returns a cached response.
+
+        :param key: Cache key.
+
+        :return: Tuple of (etag, time last validated, body) or None.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+                return entry
+        if self.path is None:
+            return None
+        try:
+            f = open(self._file(key), 'rb')
+            try:
+                etag = f.readline().rstrip('\n')
+                entry = (etag, os.fstat(f.fileno()).st_mtime, f.read())
+            finally:
+                f.close()
+        except (IOError, OSError):
+            return None
+        self._put(key, entry)
+        return entry
+
+    def _put(self, key, entry):
+        size = len(entry[0]) + len(entry[2])
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0]) + len(old[2])
+            if size > self.size:
+                return
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.size:
+                key, old = self._entries.popitem(last=False)
+                self._bytes -= len(old[0]) + len(old[2])
+
+    def set(self, key, etag, body):
+        """Stores a response with its ETag."""
+        self._put(key, (etag, time.time(), body))
+        if self.path is None:
+            return
+        path = self._file(key)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(etag + '\n' + body)
+            finally:
+                f.close()
+            os.rename(tmp, path)
+        except (IOError, OSError), e:
+            log.debug('Could not cache response %s: %s' % (key, e))
+
+    def touch(self, key):
+        """Marks a response as validated now."""
+        entry = self.get(key)
+        if entry is None:
+            return
+        self._put(key, (entry[0], time.time(), entry[2]))
+        if self.path is not None:
+            try:
+                os.utime(self._file(key), None)
+            except OSError:
+                pass
+
+    def clear(self):
+        """Drops the entries kept in memory."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+# response cache shared by all proxies
+response_cache = ResponseCache()
+
 class Proxy(object):
     """Remote object proxy class."""
 
-    def __init__(self, url):
+    def __init__(self, url, data=None, timeout=None):
         """
         Create a new Proxy instance.
 
         :param url: URL to object
+        :param data: Serialized object data, e.g. from a list response, in
+            which case the object is not read from the server.
+        :param timeout: Request timeout in seconds, default is the
+            connection pool timeout.
 
         :returns: repo.Proxy instance.
         """
+        self._timeout = timeout
         if url.split("/")[0] not in ("http:","https:"):
             raise RepoError("URL protocol must be http or https.  Value was '%s'" % url)
         self.host = "/".join(url.split("/")[2:3])
         self.base_url = "/".join(url.split("/")[0:3])
         self.url = url
+        if data is not None:
+            self.__dict__.update(data)
+            self.url = url
+            return
         try:
             response = self.request('read')
             if response.get('success', False):
@@ -57,23 +338,58 @@ class Proxy(object):
         """
         def r(*args, **kwargs):
             response = self.request(cmd, *args, **kwargs)
-            ret = []
             if cmd == 'data':
                 return response
-            elif response.get('success'):
-                data = response.get('data')
-                if type(data) == list:
-                    for item in data:
-                        p = Proxy(item.get('url', self.url))
-                        p.__dict__.update(item)
-                        ret.append(p)
-                else:
-                    return data
-            elif response.get('failure'):
-                raise ProxyError(response.get('data').get('msg'))
-            return ret
+            return self._result(response, self.url)
         return r
 
+    def _result(self, response, url):
+        """
+        Converts a response to its result, building Proxy objects for list
+        elements.
+
+        :param response: Response dict.
+        :param url: URL the response is for.
+
+        :raise: ProxyError if the response is a failure.
+        """
+        ret = []
+        if response.get('success'):
+            data = response.get('data')
+            if type(data) == list:
+                for item in data:
+                    ret.append(Proxy(item.get('url', url), data=item, timeout=self._timeout))
+            else:
+                return data
+        elif response.get('failure'):
+            raise ProxyError(response.get('data').get('msg'))
+        return ret
+
+    def batch(self, *actions):
+        """
+        Sends several actions in one request, for example:
+
+            >>> p.batch({'action': 'read'}, {'action': 'items', 'limit': 10},
+            ...         {'action': 'versions', 'path': 'shot'})
+
+        :param actions: Dicts of action name, optional path relative to this
+            proxy and action kwargs.
+
+        :returns: List of the results of the actions.
+
+        :raise: ProxyError for the first action that failed.
+        """
+        response = self.request('batch', actions=list(actions))
+        if not response.get('success'):
+            raise ProxyError(response.get('data', {}).get('msg'))
+        ret = []
+        for action, result in zip(actions, response.get('data')):
+            url = self.url
+            if action.get('path'):
+                url = '%s/%s' % (self.url.rstrip('/'), action['path'].strip('/'))
+            ret.append(self._result(result, url))
+        return ret
+
     def request(self, cmd, *args, **kwargs):
         """
         Request data fromo the server.
@@ -83,8 +399,11 @@ class Proxy(object):
         :returns: Result.
         """
         params = {'action': cmd}
-        #TODO: serialize the kwargs?
-        params.update(kwargs)
+        for k, v in kwargs.items():
+            if k in RAW_PARAMS and isinstance(v, str):
+                params[k] = v
+            else:
+                params[k] = json.dumps(v, default=str)
         return self.__request(self.url, params)
 
     def __request(self, url, params):
@@ -96,18 +415,42 @@ class Proxy(object):
         :returns: Response as dict. 
         """
         log.debug('request: %s %s' %(url, str(params)))
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        if params.get('action') != 'data':
+            headers['Accept-Encoding'] = 'gzip, deflate'
+
+        # revalidate cached responses, or use them as is within the ttl
+        key = entry = None
+        if params.get('action') != 'data' and response_cache.enabled:
+            key = response_cache.key(url, params)
+            entry = response_cache.get(key)
+            if entry is not None:
+                if time.time() - entry[1] < response_cache.ttl:
+                    return json.loads(entry[2])
+                headers['If-None-Match'] = entry[0]
         try:
-            response = urlopen(url, urlencode(params)).read()
+            retry = params.get('action') in READ_ACTIONS
+            status, response_headers, response = connection_pool.request('POST', url,
+                                                        urlencode(params), headers,
+                                                        timeout=self._timeout, retry=retry)
+            response = decode_body(response, response_headers.get('content-encoding'))
+            if status == 304 and entry is not None:
+                response_cache.touch(key)
+                response = entry[2]
+            elif key and status == 200 and response_headers.get('etag'):
+                response_cache.set(key, response_headers['etag'], response)
             if params.get('action') != 'data':
                 log.debug('response: %s' % response)
             if params.get('action', None) == 'data':
+                if status != 200:
+                    raise ProxyError(json.loads(response).get('data').get('msg'))
                 return response
             else:
                 return json.loads(response)
-        except TypeError, e:
+        except (TypeError, ValueError), e:
             log.exception('request error')
             raise ServerError(e)
-        except IOError, e:
+        except (httplib.HTTPException, IOError, zlib.error), e:
             log.error('request error: %s' % str(e))
             raise ServerError(e)
 
@@ -116,3 +459,85 @@ class Proxy(object):
 
     def isLocal(self):
         return False
+
+class AsyncProxy(object):
+    """
+    Runs proxy actions against many urls concurrently, for example to read
+    the latest versions of hundreds of repos at once:
+
+        >>> AsyncProxy().map(urls, 'versions', offset=-1)
+
+    Requests are spread over a bounded number of worker threads that share
+    the keep-alive connections of the connection pool, and each request
+    has its own socket timeout.
+    """
+
+    def __init__(self, workers=GRIT_PROXY_POOL_SIZE, timeout=GRIT_PROXY_TIMEOUT):
+        """
+        Create a new AsyncProxy instance.
+
+        :param workers: Max number of concurrent requests.
+        :param timeout: Per request timeout in seconds.
+
+        :returns: AsyncProxy instance.
+        """
+        self.workers = workers
+        self.timeout = timeout
+
+    def __repr__(self):
+        return '<grit.AsyncProxy [%d]>' % self.workers
+
+    def _call(self, url, action, kwargs):
+        """Runs one action, 'read' returns a Proxy like Proxy(url) does."""
+        proxy = Proxy(url, data={}, timeout=self.timeout)
+        if action == 'read':
+            data = proxy._result(proxy.request('read'), url)
+            return Proxy(url, data=data, timeout=self.timeout)
+        return getattr(proxy, action)(**kwargs)
+
+    def gather(self, requests):
+        """
+        Runs requests concurrently and waits for all of them.
+
+        :param requests: List of (url, action, kwargs dict) tuples.
+
+        :returns: List of the results in request order. A request that
+            failed has the exception it raised in place of its result.
+        """
+        requests = list(requests)
+        results = [None] * len(requests)
+        pending = Queue.Queue()
+        for i, request in enumerate(requests):
+            pending.put((i, request))
+
+        def work():
+            while True:
+                try:
+                    i, (url, action, kwargs) = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    results[i] = self._call(url, action, kwargs)
+                except Exception, e:
+                    log.debug('async request error: %s %s' % (url, e))
+                    results[i] = e
+
+        threads = [threading.Thread(target=work) for i in range(min(self.workers, len(requests)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def map(self, urls, action='read', **kwargs):
+        """
+        Runs the same action against each url concurrently.
+
+        :param urls: List of proxy urls.
+        :param action: Action name.
+        :param kwargs: Action kwargs.
+
+        :returns: List of the results in url order, see gather().
+        """
+        return self.gather([(url, action, kwargs) for url in urls])
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011-2012 Ryan Galloway (ryan@rsgalloway.com)
+#
+# This module is part of Grit and is released under
+# the BSD License: http://www.opensource.org/licenses/bsd-license.php
+
+import os
+import zlib
+import tempfile
+from hashlib import sha1
+
+from dulwich.file import GitFile
+from dulwich.objects import Blob
+from dulwich.pack import Pack, iter_sha1, write_pack_data, write_pack_index_v2
+
+from grit.cfg import GRIT_UNPACK_LIMIT
+
+__all__ = ['BlobReader', 'has_object', 'add_objects', 'write_pack', 'write_blob']
+
+def has_object(store, sha):
+    """
+    Checks if an object exists without reading it. Unlike `sha in store`,
+    which parses loose objects, this only stats the loose object path and
+    checks the pack indexes.
+
+    :param store: Object store.
+    :param sha: Object sha.
+
+    :return: True if the object is in the store.
+    """
+    path = getattr(store, 'path', None)
+    if path is None:
+        return sha in store
+    if os.path.exists(os.path.join(path, sha[:2], sha[2:])):
+        return True
+    if store.contains_packed(sha):
+        return True
+    for alternate in store.alternates:
+        if sha in alternate:
+            return True
+    return False
+
+def add_objects(store, objects, pack=False):
+    """
+    Adds the objects that are not in the store yet.
+
+    :param store: Object store.
+    :param objects: List of (sha, object or callable returning the object)
+        tuples. Callables are only called for new objects, so carried over
+        objects are never read.
+    :param pack: Write the new objects to a single pack file instead of
+        one loose object each, if there are at least GRIT_UNPACK_LIMIT of
+        them. Every pack is searched on lookups, so small publishes are
+        stored loose rather than adding yet another pack.
+
+    :return: List of the shas added.
+    """
+    added = []
+    new = []
+    seen = set()
+    for sha, obj in objects:
+        if sha in seen or has_object(store, sha):
+            continue
+        seen.add(sha)
+        added.append(sha)
+        new.append(obj)
+    if pack and len(new) >= GRIT_UNPACK_LIMIT and hasattr(store, 'pack_dir'):
+        write_pack(store, new)
+    else:
+        for obj in new:
+            if callable(obj):
+                obj = obj()
+            store.add_object(obj)
+    return added
+
+def write_pack(store, objects):
+    """
+    Streams objects into one new pack file plus index in the store, reading
+    and compressing a single object at a time.
+
+    :param store: DiskObjectStore.
+    :param objects: List of objects or callables returning the object.
+
+    :return: Path of the new pack file, or None if there were no objects.
+    """
+    if not objects:
+        return None
+
+    def records():
+        for obj in objects:
+            if callable(obj):
+                obj = obj()
+            yield obj.type_num, obj.sha().digest(), None, obj.as_raw_string()
+
+    fd, path = tempfile.mkstemp(dir=store.pack_dir, suffix='.pack')
+    f = os.fdopen(fd, 'wb')
+    try:
+        entries, checksum = write_pack_data(f, len(objects), records())
+        f.flush()
+        os.fsync(fd)
+        f.close()
+    except:
+        f.close()
+        os.remove(path)
+        raise
+
+    # name the pack after its contents and move it in next to its index
+    entries = sorted([(sha, offset, crc32) for sha, (offset, crc32) in entries.items()])
+    basename = os.path.join(store.pack_dir, 'pack-%s' % iter_sha1(e[0] for e in entries))
+    f = GitFile(basename + '.idx', 'wb')
+    try:
+        write_pack_index_v2(f, entries, checksum)
+    finally:
+        f.close()
+    os.chmod(path, 0444)
+    os.rename(path, basename + '.pack')
+    if hasattr(store, '_add_known_pack'):
+        store._add_known_pack(basename, Pack(basename))
+    return basename + '.pack'
+
+def write_blob(store, path, bufsize=65536):
+    """
+    Streams a file into the store as a loose blob, hashing and compressing
+    it a chunk at a time, so memory use does not depend on the file size.
+
+    :param store: DiskObjectStore.
+    :param path: File path.
+    :param bufsize: Read chunk size.
+
+    :return: Blob sha.
+    """
+    size = os.path.getsize(path)
+    header = 'blob %d\0' % size
+    sha = sha1(header)
+    compress = zlib.compressobj()
+    fd, tmp = tempfile.mkstemp(dir=store.path)
+    out = os.fdopen(fd, 'wb')
+    try:
+        out.write(compress.compress(header))
+        f = open(path, 'rb')
+        try:
+            for chunk in iter(lambda: f.read(bufsize), ''):
+                size -= len(chunk)
+                sha.update(chunk)
+                out.write(compress.compress(chunk))
+        finally:
+            f.close()
+        if size != 0:
+            raise IOError('File changed while reading: %s' % path)
+        out.write(compress.flush())
+        out.close()
+    except:
+        out.close()
+        os.remove(tmp)
+        raise
+
+    # move into place, unless the object already exists
+    hexsha = sha.hexdigest()
+    objdir = os.path.join(store.path, hexsha[:2])
+    if not os.path.isdir(objdir):
+        try:
+            os.mkdir(objdir)
+        except OSError:
+            pass
+    dest = os.path.join(objdir, hexsha[2:])
+    if os.path.exists(dest):
+        os.remove(tmp)
+    else:
+        os.chmod(tmp, 0444)
+        os.rename(tmp, dest)
+    return hexsha
+
+class BlobReader(object):
+    """
+    Read-only file-like object over the data of a blob that decompresses
+    loose and packed objects a chunk at a time, so the blob is never held in
+    memory. Objects that cannot be streamed, e.g. deltified pack entries,
+    are read in full.
+    """
+
+    def __init__(self, store, sha, bufsize=65536):
+        """
+        Create a new BlobReader instance.
+
+        :param store: Object store.
+        :param sha: Blob sha.
+        :param bufsize: Read chunk size.
+
+        :returns: BlobReader instance.
+        """
+        self.store = store
+        self.sha = sha
+        self.bufsize = bufsize
+        self.size = None
+        self._file = None
+        self._whole = None
+        self._open()
+
+    def __repr__(self):
+        return '<grit.BlobReader "%s">' % self.sha
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.bufsize), '')
+
+    def _locate(self):
+        """:return: Tuple of (path, pack offset or None), or None"""
+        path = getattr(self.store, 'path', None)
+        if path is None:
+            return None
+        loose = os.path.join(path, self.sha[:2], self.sha[2:])
+        if os.path.exists(loose):
+            return loose, None
+        for pack in self.store.packs:
+            try:
+                offset = pack.index.object_index(self.sha)
+            except KeyError:
+                continue
+            if offset is not None:
+                return getattr(pack, '_data_path', None), offset
+        return None
+
+    def _open(self):
+        """Opens the object and reads its header."""
+        self.close()
+        self._pos = 0
+        self._buf = ''
+        self._done = False
+        self._inflate = zlib.decompressobj()
+        source = self._locate()
+        if source and source[0]:
+            path, offset = source
+            self._file = open(path, 'rb')
+            if offset is None:
+                header = self._read_loose_header()
+            else:
+                self._file.seek(offset)
+                header = self._read_pack_header()
+            if header is not None:
+                self.size = header
+                if self.size == 0:
+                    self._done = True
+                    self.close()
+                return
+            self.close()
+
+        # fall back to reading the whole object
+        self._whole = self._buf = self.store[self.sha].as_raw_string()
+        self.size = len(self._buf)
+        self._done = True
+
+    def _read_loose_header(self):
+        """:return: Blob size, or None if the object is not a blob"""
+        while '\0' not in self._buf:
+            data = self._inflate.decompress(self._file.read(64))
+            if not data:
+                return None
+            self._buf += data
+        header, self._buf = self._buf.split('\0', 1)
+        kind, size = header.split(' ', 1)
+        if kind != 'blob':
+            return None
+        return int(size)
+
+    def _read_pack_header(self):
+        """:return: Blob size, or None if the entry is not a whole blob"""
+        c = ord(self._file.read(1))
+        kind = (c >> 4) & 7
+        size = c & 15
+        shift = 4
+        while c & 0x80:
+            c = ord(self._file.read(1))
+            size += (c & 0x7f) << shift
+            shift += 7
+        if kind != Blob.type_num:
+            return None
+        return size
+
+    def _fill(self, n):
+        """Decompresses until n bytes are buffered or the blob ends."""
+        while not self._done and len(self._buf) < n:
+            tail = self._inflate.unconsumed_tail
+            if tail:
+                data = self._inflate.decompress(tail, self.bufsize)
+            else:
+                chunk = self._file.read(self.bufsize)
+                if not chunk:
+                    data = self._inflate.flush()
+                    self._done = True
+                else:
+                    data = self._inflate.decompress(chunk, self.bufsize)
+            self._buf += data
+            if self._pos + len(self._buf) >= self.size:
+                self._buf = self._buf[:self.size - self._pos]
+                self._done = True
+        if self._done:
+            self.close()
+
+    def read(self, n=-1):
+        """
+        Reads up to n bytes, or the rest of the blob if n is negative.
+
+        :param n: Number of bytes.
+
+        :return: Data string, empty at the end of the blob.
+        """
+        if n is None or n < 0:
+            n = self.size - self._pos
+        self._fill(n)
+        data, self._buf = self._buf[:n], self._buf[n:]
+        self._pos += len(data)
+        return data
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        """
+        Moves to offset. Seeking forward decompresses and discards the data
+        in between, seeking backward starts over from the beginning.
+        """
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self.size
+        offset = max(0, min(offset, self.size))
+        if offset < self._pos:
+            if self._whole is not None:
+                self._buf = self._whole[offset:]
+                self._pos = offset
+                return
+            self._open()
+        while self._pos < offset:
+            if not self.read(min(self.bufsize, offset - self._pos)):
+                break
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
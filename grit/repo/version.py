@@ -7,6 +7,7 @@
 
 import os
 import re
+import shutil
 import traceback
 import simplejson as json
 from time import time
@@ -15,7 +16,10 @@ from datetime import datetime
 import dulwich
 from dulwich.objects import Blob, Commit, parse_timezone
 
+from grit.repo import get_index, lookup_path, regex_prefix
+from grit.repo import BlobReader, add_objects, write_blob
 from grit.util import serialize, deserialize, is_tree
+from grit.cfg import GRIT_STREAM_SIZE
 from grit.log import log
 from grit.exc import *
 
@@ -48,17 +52,52 @@ class ItemsMixin:
         except AttributeError, e:
             raise VersionError('Saved versions are immutable')
 
+    def _tree_index(self):
+        """:return: TreeIndex of the stored tree, or None if it is mutable"""
+        tree = self.tree
+        if tree is None or isinstance(tree, Tree):
+            return None
+        return get_index(self.repo.object_store, tree.id)
+
     def iteritems(self):
         """Generator that yields Items"""
         if self.type in ['blob']:
             raise StopIteration
 
+        index = self._tree_index()
+        if index is not None:
+            for path, mode, sha in index:
+                yield Item(self, sha, path, mode)
+            raise StopIteration
+
         for path, mode, sha in self.tree.iteritems():
             item = Item(self, sha, path, mode)
             yield item
             for i in item.iteritems():
                 yield i
 
+    def getItem(self, path):
+        """
+        Returns the item at path, reading only the trees along the path.
+
+        :param path: Item path, relative to this version or tree.
+
+        :return: Item class object or None.
+        """
+        tree = self.tree
+        if tree is None or self.type in ['blob']:
+            return None
+        if isinstance(tree, Tree):
+            base = getattr(self, 'path', '')
+            for item in self.iteritems():
+                if item.path == os.path.join(base, path):
+                    return item
+            return None
+        entry = lookup_path(self.repo.object_store, tree.id, path)
+        if entry:
+            return Item(self, entry[1], path, entry[0])
+        return None
+
     #TODO: move path arg to iteritems, items() returns only local items
     def items(self, path=None):
         """
@@ -68,12 +107,23 @@ class ItemsMixin:
 
         :return: List of Item class objects.
         """
-        items = list(self.iteritems())
-        if path is not None:
-            path += '$'
-            regex = re.compile(path)
-            items = [i for i in items if regex.match(i.path)]
-        return items
+        if path is None:
+            return list(self.iteritems())
+        regex = re.compile(path + '$')
+        index = self._tree_index()
+        if index is None:
+            return [i for i in self.iteritems() if regex.match(i.path)]
+
+        # only scan the index entries sharing the literal part of the regex
+        base = getattr(self, 'path', '')
+        prefix = regex_prefix(path)
+        if base:
+            if prefix.startswith(base + '/'):
+                prefix = prefix[len(base)+1:]
+            else:
+                prefix = ''
+        return [Item(self, sha, p, mode) for p, mode, sha in index.prefix(prefix)
+                if regex.match(os.path.join(base, p))]
 
 class Item(object, ItemsMixin):
 
@@ -88,6 +138,7 @@ class Item(object, ItemsMixin):
 
         :returns: repo.Item instance.
         """
+        self.tree = None
         self.blob = None
         self.parent = parent
         self.path = os.path.join(getattr(parent, 'path', ''), path)
@@ -99,10 +150,6 @@ class Item(object, ItemsMixin):
         self.comment = getattr(self.parent, 'message', None)
         self.date = getattr(self.parent, 'date', None)
 
-        # do not run get_object on blobs on init
-        if self.type == 'tree':
-            self.tree = self.repo.get_object(self.id)
-
     def __repr__(self):
         return '<grit.Item "%s">' %(self.path)
 
@@ -121,6 +168,17 @@ class Item(object, ItemsMixin):
         else:
             return 'blob'
 
+    def _get_tree(self):
+        """read tree on access only because get_object is slow"""
+        if self.__tree is None and self.type == 'tree':
+            self.__tree = self.repo.get_object(self.id)
+        return self.__tree
+
+    def _set_tree(self, tree):
+        self.__tree = tree
+
+    tree = property(_get_tree, _set_tree)
+
     def _get_blob(self):
         """read blob on access only because get_object is slow"""
         if not self.__blob:
@@ -136,7 +194,9 @@ class Item(object, ItemsMixin):
 
     @property
     def size(self):
-        return self.blob.raw_length()
+        if self.__blob:
+            return self.blob.raw_length()
+        return self.file().size
 
     @property
     def log(self):
@@ -155,8 +215,17 @@ class Item(object, ItemsMixin):
         """
         if name is None:
             name = os.path.basename(path)
-        #FIXME: hack, there has to be a better way
-        return Item.from_string(repo=repo, name=name, string=open(path).read())
+
+        # small files are stored with the version, large files are streamed
+        # into the object store so they are never held in memory
+        store = repo.object_store
+        if os.path.getsize(path) < GRIT_STREAM_SIZE or not hasattr(store, 'path'):
+            return Item.from_string(repo=repo, name=name, string=open(path, 'rb').read())
+        try:
+            log.debug('Streaming new item: %s' % name)
+            return Item(parent=repo, sha=write_blob(store, path), path=name)
+        except (IOError, OSError), e:
+            raise ItemError(e)
 
     @classmethod
     def from_string(self, repo, name, string):
@@ -179,9 +248,11 @@ class Item(object, ItemsMixin):
             raise ItemError(e)
 
     def file(self):
-        """:return: File-like StringIO object"""
-        from StringIO import StringIO
-        return StringIO(self.data())
+        """:return: File-like object that streams the blob data"""
+        if self.__blob:
+            from StringIO import StringIO
+            return StringIO(self.data())
+        return BlobReader(self.repo.object_store, self.id)
 
     def data(self):
         """:return: blob data"""
@@ -214,9 +285,11 @@ class Item(object, ItemsMixin):
             path = os.path.join(path, self.name)
         try:
             log.debug('Checking out %s to %s' %(self.path, path))
-            f = open(path, 'w')
-            f.write(self.data())
-            f.close()
+            f = open(path, 'wb')
+            try:
+                shutil.copyfileobj(self.file(), f)
+            finally:
+                f.close()
             return True
         except Exception, e:
             raise ItemError(e)
@@ -230,12 +303,13 @@ class Item(object, ItemsMixin):
             _versions = _versions[index]
         return _versions
 
-    def serialize(self):
+    def serialize(self, fields=None):
         d = self.__dict__
         d['desc'] = self.comment
-        if self.parent and self.parent.repo:
-            d['parent'] = self.parent.repo.name
-        return serialize(d)
+        if fields is None or 'parent' in fields:
+            if self.parent and self.parent.repo:
+                d['parent'] = self.parent.repo.name
+        return serialize(d, fields)
 
     def deserialize(self, params):
         deserialize(self, params)
@@ -255,6 +329,7 @@ class Tree(dulwich.objects.Tree):
         super(Tree, self).__init__()
         self.type == 'tree'
         self.__items = {}
+        self.__stored = {}
 
     def __str__(self):
         return str(self.id)
@@ -271,13 +346,68 @@ class Tree(dulwich.objects.Tree):
     def items(self):
         return self.__items.values()
 
-    def addItem(self, item):
+    def newItems(self):
+        """:return: Items that may not be in the object store yet"""
+        return [item for name, item in self.__items.items()
+                if self.__stored.get(name) != item.id]
+
+    def addItem(self, item, stored=False):
+        """
+        Adds an item to the tree.
+
+        :param item: Item instance.
+        :param stored: The item is known to be in the object store already,
+            e.g. when it is carried over from the previous version.
+        """
         super(Tree, self).add(item.mode, item.name, item.id)
         self.__items[item.name] = item
+        if stored:
+            self.__stored[item.name] = item.id
 
     def removeItem(self, item):
         del self._entries[item.name]
         del self.__items[item.name]
+        self.__stored.pop(item.name, None)
+
+class Versions(object):
+    """
+    Lazy sequence of the Versions of a repo, oldest first. Version objects
+    are only created for the elements that are accessed.
+    """
+
+    def __init__(self, repo, ids):
+        """
+        Create a new Versions instance.
+
+        :param repo: Instance of repo.Local.
+        :param ids: List of commit shas.
+
+        :return: repo.Versions instance.
+        """
+        self.repo = repo
+        self.ids = ids
+
+    def __repr__(self):
+        return '<grit.Versions "%s" [%d]>' % (self.repo, len(self))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for sha in self.ids:
+            yield self._version(sha)
+
+    def __reversed__(self):
+        for sha in reversed(self.ids):
+            yield self._version(sha)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Versions(self.repo, self.ids[index])
+        return self._version(self.ids[index])
+
+    def _version(self, sha):
+        return Version(self.repo, self.repo.object_store[sha])
 
 class Version(object, ItemsMixin):
 
@@ -296,14 +426,7 @@ class Version(object, ItemsMixin):
         self.user = str(self.commit.author)
         self.comment = str(self.commit.message)
         self.date = datetime.utcfromtimestamp(self.commit.commit_time)
-
-        if tree is None:
-            try:
-                self.tree = self.repo.get_object(self.commit.tree)
-            except KeyError:
-                self.tree = None
-        else:
-            self.tree = tree
+        self.tree = tree
 
     def __str__(self):
         return str(self.commit.id)
@@ -321,10 +444,24 @@ class Version(object, ItemsMixin):
     def version(self):
         """:return: Version number / index in list of versions"""
         try:
-            return self.repo._commits().index(self.commit)
+            return self.repo._history().index(self.commit.id)
         except ValueError:
             return None
 
+    def _get_tree(self):
+        """read tree on access only because get_object is slow"""
+        if self.__tree is None:
+            try:
+                self.__tree = self.repo.get_object(self.commit.tree)
+            except KeyError:
+                pass
+        return self.__tree
+
+    def _set_tree(self, tree):
+        self.__tree = tree
+
+    tree = property(_get_tree, _set_tree)
+
     def _get_parent(self):
         return self.repo.versions(-1)
 
@@ -333,21 +470,25 @@ class Version(object, ItemsMixin):
 
     parent = property(_get_parent, _set_parent)
 
-    def save(self, message):
+    def save(self, message, pack=False):
         """
         Add version to repo object store, set repo head to version sha.
 
         :param message: Message string.
+        :param pack: Write the new objects as a single pack file, which is
+            much faster than loose objects when publishing many files. Small
+            publishes are stored loose, see add_objects.
         """
         self.commit.message = message
         self.commit.tree = self.tree
-        #TODO: store new blobs only
-        for item in self.tree.items():
-            self.repo.object_store.add_object(item.blob)
-        self.repo.object_store.add_object(self.tree)
+
+        # store new objects only, carried over items are not even looked up
+        objects = [(item.id, lambda item=item: item.blob) for item in self.tree.newItems()]
+        objects.append((self.tree.id, self.tree))
+        objects.append((self.commit.id, self.commit))
+        add_objects(self.repo.object_store, objects, pack=pack)
 
         # set HEAD to new commit
-        self.repo.object_store.add_object(self.commit)
         self.repo.refs['refs/heads/master'] = self.commit.id
 
     @classmethod
@@ -378,10 +519,9 @@ class Version(object, ItemsMixin):
 
             # create new tree, add entries from previous version
             tree = Tree()
-            curr = repo.versions(-1)
-            if curr:
-                for item in curr.items():
-                    tree.addItem(item)
+            if parent:
+                for item in parent.items():
+                    tree.addItem(item, stored=True)
             commit.tree = tree.id
 
             # create new version, and add tree
@@ -395,10 +535,10 @@ class Version(object, ItemsMixin):
     def checkout(self, path=None):
         raise NotImplementedError
 
-    def serialize(self):
+    def serialize(self, fields=None):
         d = self.__dict__
         d['desc'] = self.comment
-        return serialize(d)
+        return serialize(d, fields)
 
     def deserialize(self, params):
         return deserialize(params)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2011-2012 Ryan Galloway (ryan@rsgalloway.com)
+#
+# This module is part of Grit and is released under
+# the BSD License: http://www.opensource.org/licenses/bsd-license.php
+
+import os
+import stat
+import shutil
+import tempfile
+import threading
+
+from grit.repo.store import BlobReader
+from grit.log import log
+from grit.cfg import GRIT_BLOB_CACHE_DIR, GRIT_BLOB_CACHE_SIZE
+
+__all__ = ['BlobCache']
+
+class BlobCache(object):
+    """
+    On-disk cache of decompressed blob data, stored as one plain file per
+    blob sha, so hot blobs can be served from a real file handle, e.g.
+    through wsgi.file_wrapper, instead of being inflated on every request.
+
+    Blob shas name immutable content, so cached files never go stale. Files
+    are touched when used, and the least recently used files are removed
+    once the cache grows over max_size bytes.
+
+    Cached files are trusted as is, so the cache dir is created private to
+    the server user, and not used at all if anyone else could write to it.
+    """
+
+    def __init__(self, path=GRIT_BLOB_CACHE_DIR, max_size=GRIT_BLOB_CACHE_SIZE):
+        """
+        Create a new BlobCache instance.
+
+        :param path: Cache directory.
+        :param max_size: Max total size of the cached files in bytes.
+
+        :returns: BlobCache instance.
+        """
+        self.path = path
+        self.max_size = max_size
+        self._size = None
+        self._private = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<grit.BlobCache "%s">' % self.path
+
+    def _path(self, sha):
+        return os.path.join(self.path, sha[:2], sha[2:])
+
+    def _is_private(self):
+        """:return: True if the cache dir is only writable by the server user"""
+        if self._private is None:
+            try:
+                os.makedirs(self.path, 0700)
+            except OSError:
+                pass
+            try:
+                st = os.lstat(self.path)
+                self._private = stat.S_ISDIR(st.st_mode) and not st.st_mode & 022 \
+                    and st.st_uid == getattr(os, 'getuid', lambda: st.st_uid)()
+            except OSError:
+                self._private = False
+            if not self._private:
+                log.warning('Not using blob cache %s, it is not private' % self.path)
+        return self._private
+
+    def _files(self):
+        """:return: List of (mtime, size, path) tuples of the cached files"""
+        files = []
+        for root, dirs, names in os.walk(self.path):
+            for name in names:
+                if name.startswith('tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        return files
+
+    def open(self, store, sha):
+        """
+        Returns the data of a blob as a file, adding the blob to the cache
+        first if it is not cached yet. Blobs larger than the cache, or that
+        cannot be cached, are returned as a BlobReader.
+
+        :param store: Object store.
+        :param sha: Blob sha.
+
+        :return: File object opened for reading.
+        """
+        if not self._is_private():
+            return BlobReader(store, sha)
+        path = self._path(sha)
+        try:
+            f = open(path, 'rb')
+            os.utime(path, None)
+            return f
+        except (IOError, OSError):
+            pass
+
+        reader = BlobReader(store, sha)
+        if reader.size > self.max_size:
+            return reader
+        try:
+            self._add(reader, path)
+            return open(path, 'rb')
+        except (IOError, OSError), e:
+            log.debug('Could not cache blob %s: %s' % (sha, e))
+            reader.seek(0)
+            return reader
+
+    def _add(self, reader, path):
+        """Writes the blob data to path and evicts old files if needed."""
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                pass
+        fd, tmp = tempfile.mkstemp(prefix='tmp', dir=self.path)
+        f = os.fdopen(fd, 'wb')
+        try:
+            shutil.copyfileobj(reader, f)
+            f.close()
+            os.rename(tmp, path)
+        except:
+            f.close()
+            os.remove(tmp)
+            raise
+        with self._lock:
+            if self._size is None:
+                self._size = sum([f[1] for f in self._files()])
+            else:
+                self._size += reader.size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """Removes least recently used files until the cache is 90% full."""
+        files = sorted(self._files())
+        self._size = sum([f[1] for f in files])
+        for mtime, size, path in files:
+            if self._size <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
@@ -40,6 +40,8 @@ import re
 import urlparse
 from collections import defaultdict
 
+from grit.repo import repo_resolver
+
 # needed for static content server
 import time
 import email.utils
@@ -72,6 +74,10 @@ class BaseWSGIClass(object):
         '417':'417 Execution failed',
         'execution_failed':'417 Execution failed',
         '200': "200 OK",
+        '206': "206 Partial Content",
+        'partial_content': "206 Partial Content",
+        '416': "416 Requested Range Not Satisfiable",
+        'range_not_satisfiable': "416 Requested Range Not Satisfiable",
         '501': "501 Not Implemented",
         'not_implemented': "501 Not Implemented"
     }
@@ -424,6 +430,7 @@ class GitHTTPBackendBase(BaseWSGIClass):
                         return self.canned_handlers(environ, start_response, 'forbidden')
                 if subprocess.call('git init --quiet --bare "%s"' % repo_path, shell=True):
                     return self.canned_handlers(environ, start_response, 'execution_failed')
+                repo_resolver.add(repo_path)
         #
         #############################################################
 
@@ -8,10 +8,13 @@
 import os
 import sys
 import urllib
+import itertools
+import collections
 import simplejson as json
 
 from grit.repo import Local
-from grit.repo import is_repo, get_repos
+from grit.repo import is_repo, get_repos, repo_catalog
+from grit.repo.version import Versions
 from grit.repo.version import Item
 from grit.util import serialize
 from grit.exc import *
@@ -21,6 +24,49 @@ __doc__ = """
 This module contains server handler functions.
 """
 
+def parse_fields(fields):
+    """
+    :param fields: List of field names, or comma separated names.
+
+    :return: List of field names, or None.
+    """
+    if isinstance(fields, basestring):
+        fields = [f.strip() for f in fields.split(',') if f.strip()]
+    return fields
+
+def _page(kwargs):
+    """
+    Pops the paging and projection params from the request kwargs.
+
+    :param kwargs: Request kwargs.
+
+    :return: Tuple of (offset, limit or None, list of fields or None).
+    """
+    offset = int(kwargs.pop('offset', 0) or 0)
+    limit = kwargs.pop('limit', None)
+    if limit is not None:
+        limit = int(limit)
+        if limit < 0:
+            raise ValueError('Invalid limit: %d' % limit)
+    fields = parse_fields(kwargs.pop('fields', None))
+    return offset, limit, fields
+
+def _window(seq, offset=0, limit=None):
+    """
+    Returns the limit elements of seq from offset, slicing sequences and
+    consuming only as much of iterators as needed. A negative offset counts
+    from the end, e.g. offset=-1 is the last element.
+    """
+    stop = None if limit is None else offset + limit
+    if offset < 0 and stop is not None and stop >= 0:
+        stop = None
+    if isinstance(seq, (list, tuple, Versions)):
+        return seq[offset:stop]
+    if offset < 0:
+        # keep only the tail of the iterator
+        return list(collections.deque(seq, maxlen=-offset))[:limit]
+    return itertools.islice(seq, offset, stop)
+
 def handle_read(repo, **kwargs):
     """handles reading repo information"""
     log.info('read: %s %s' %(repo, kwargs))
@@ -41,7 +87,7 @@ def handle_branch(repo, **kwargs):
     if type(repo) in [unicode, str]:
         path = os.path.join(repo, kwargs.get('name', 'Unnamed'))
         desc = kwargs.get('desc')
-        branch = Repo.new(path=path, desc=desc, bare=True)
+        branch = Local.new(path=path, desc=desc, bare=True)
     else:
         name = kwargs.get('name')
         path = kwargs.get('path')
@@ -57,15 +103,23 @@ def handle_delete(repo, **kwargs):
 
 def handle_repos(repo, **kwargs):
     log.info('repos: %s %s' %(repo, kwargs))
-    repos = get_repos(getattr(repo, 'abspath', repo))
-    return [r.serialize() for r in repos]
+    offset, limit, fields = _page(kwargs)
+    repos = repo_catalog.list(getattr(repo, 'abspath', repo), offset, limit)
+    if fields is not None:
+        repos = [dict([(k, v) for k, v in r.items() if k in fields]) for r in repos]
+    return repos
 
 def handle_items(repo, **kwargs):
     """:return: repo.files()"""
     log.info('items: %s %s' %(repo, kwargs))
     if not hasattr(repo, 'items'):
         return []
-    return [i.serialize() for i in repo.items(**kwargs)]
+    offset, limit, fields = _page(kwargs)
+    if isinstance(repo, Local):
+        items = repo.iteritems(**kwargs)
+    else:
+        items = repo.items(**kwargs)
+    return (i.serialize(fields) for i in _window(items, offset, limit))
 
 def handle_addItem(repo, **kwargs):
     """:return: repo.addItem()"""
@@ -81,7 +135,9 @@ def handle_versions(repo, **kwargs):
     log.info('versions: %s %s' %(repo, kwargs))
     if not hasattr(repo, 'versions'):
         return []
-    return [v.serialize() for v in repo.versions(**kwargs)]
+    offset, limit, fields = _page(kwargs)
+    versions = repo.versions(**kwargs)
+    return (v.serialize(fields) for v in _window(versions, offset, limit))
 
 def handle_submodules(repo, **kwargs):
     """:return: repo.submodules()"""
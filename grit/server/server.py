@@ -7,9 +7,13 @@
 
 import os
 import sys
+import zlib
 import urllib
 import urlparse
+import uuid
+import types
 import simplejson as json
+from hashlib import sha1
 
 from datetime import datetime as dt
 
@@ -22,12 +26,14 @@ from git_http_backend import GitHTTPBackendSmartHTTP
 from git_http_backend import WSGIHandlerSelector
 from git_http_backend import StaticWSGIServer
 
-from grit.repo import Local
-from grit.repo import is_repo, get_repo_parent
+from grit.repo import Local, Item
+from grit.repo import is_repo, get_repo_parent, has_object, repo_pool
+from grit.repo.proxy import RAW_PARAMS
 from grit.server.handler import *
+from grit.server.cache import BlobCache
 from grit.exc import *
 from grit.log import log
-from grit.cfg import GRIT_STATIC_DIR
+from grit.cfg import GRIT_STATIC_DIR, GRIT_GZIP_RESPONSE, GRIT_GZIP_MIN_SIZE
 
 # needed for static content server
 import time
@@ -38,6 +44,218 @@ mimetypes.add_type('application/x-git-packed-objects','.pack')
 
 __all__ = ['Server']
 
+# json actions that only read repo state
+CACHEABLE = ('read', 'items', 'versions')
+
+# python literals sent as parameters by older clients
+LITERALS = {'True': True, 'False': False, 'None': None}
+
+# max byte ranges served in one response, more are served as a whole
+MAX_RANGES = 16
+
+# content types worth compressing, by prefix or suffix
+COMPRESSIBLE = ('text/', 'application/json', 'application/javascript',
+                'application/xml', '+xml')
+
+# decompressed blob data cache shared by the servers
+blob_cache = BlobCache()
+
+def is_inside(path, root):
+    """:return: True if path is root or below it"""
+    root = os.path.abspath(root)
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+def is_blob(item):
+    """:return: True if item is a file Item, not a dir or a repo"""
+    return isinstance(item, Item) and item.type == 'blob'
+
+def open_item(item):
+    """
+    Returns the data of an item as a file, from the blob cache when the blob
+    is in the object store, so it can be served from a real file handle.
+
+    :param item: Item instance of a blob, see is_blob().
+
+    :return: Tuple of (file-like object, size in bytes).
+    """
+    store = item.repo.object_store
+    if has_object(store, item.id):
+        f = blob_cache.open(store, item.id)
+    else:
+        f = item.file()
+    if hasattr(f, 'size'):
+        return f, f.size
+    if hasattr(f, 'fileno'):
+        return f, os.fstat(f.fileno()).st_size
+    return f, len(f.getvalue())
+
+def decode_param(value):
+    """
+    Decodes a form encoded request parameter. Values are sent JSON encoded,
+    anything that is not valid JSON is kept as a string.
+
+    :param value: Parameter string.
+
+    :return: Decoded value.
+    """
+    if value in LITERALS:
+        return LITERALS[value]
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+def repo_etag(repo, *args):
+    """
+    Returns an ETag for a response that depends only on the state of a repo
+    and its parents: their head commits and descriptions.
+
+    :param repo: Local instance.
+    :param args: Strings that identify the response, e.g. action and kwargs.
+
+    :return: Quoted ETag string.
+    """
+    parts = list(args)
+    while repo:
+        try:
+            desc = os.stat(os.path.join(repo.git_dir, 'description')).st_mtime
+        except OSError:
+            desc = None
+        parts.extend([repo.git_dir, getattr(repo._head(), 'id', None), desc])
+        repo = repo.parent
+    return '"%s"' % sha1('\0'.join([str(p) for p in parts])).hexdigest()
+
+def etag_matches(environ, etag):
+    """
+    Checks the If-None-Match request header against an ETag.
+
+    :param environ: WSGI environ.
+    :param etag: Quoted ETag string.
+
+    :return: True if the client already has the content.
+    """
+    header = environ.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(',')]
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+def parse_range(header, size):
+    """
+    Parses a Range request header.
+
+    :param header: Range header value, e.g. "bytes=0-99,-100".
+    :param size: Content size in bytes.
+
+    :return: Sorted list of inclusive (first, last) byte offsets of the
+        satisfiable ranges, with overlapping and adjacent ranges merged, or
+        None if the header is not a valid bytes range or has more than
+        MAX_RANGES ranges.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip() != 'bytes' or spec.count(',') >= MAX_RANGES:
+        return None
+    ranges = []
+    for part in spec.split(','):
+        first, sep, last = part.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if not first:
+                # suffix range, the last n bytes
+                n = int(last)
+                if n < 0:
+                    return None
+                if n == 0:
+                    continue
+                first, last = max(0, size - n), size - 1
+            else:
+                first = int(first)
+                last = min(int(last), size - 1) if last else size - 1
+        except ValueError:
+            return None
+        if first < 0 or last < first:
+            if first < size:
+                return None
+            continue
+        if first < size:
+            ranges.append((first, last))
+
+    # coalesce, so each byte is read once and the blob front to back
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(last, merged[-1][1]))
+        else:
+            merged.append((first, last))
+    return merged
+
+def iter_range(f, first, last, bufsize=65536):
+    """
+    Generator that yields the bytes first to last of a file, reading no
+    further than last.
+    """
+    f.seek(first)
+    remaining = last - first + 1
+    while remaining > 0:
+        data = f.read(min(bufsize, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+def accept_encoding(environ):
+    """
+    Returns the content coding to compress a response with, as negotiated
+    by the Accept-Encoding request header, preferring gzip.
+
+    :param environ: WSGI environ.
+
+    :return: 'gzip', 'deflate' or None.
+    """
+    accepted = {}
+    for part in environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        params = part.split(';')
+        q = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[params[0].strip().lower()] = q
+    for coding in ('gzip', 'deflate'):
+        if accepted.get(coding, accepted.get('*', 0.0)) > 0:
+            return coding
+    return None
+
+def is_compressible(content_type):
+    """:return: True if content of this type is worth compressing"""
+    content_type = (content_type or '').split(';')[0].strip()
+    return bool(content_type) and \
+        (content_type.startswith(COMPRESSIBLE) or content_type.endswith(COMPRESSIBLE))
+
+def compress(chunks, coding, flush=False):
+    """
+    Generator that compresses chunks of data as a gzip or deflate stream,
+    holding no more than the compressor state in memory.
+
+    :param chunks: Iterable of data strings.
+    :param coding: 'gzip' or 'deflate'.
+    :param flush: Flush the compressor after each chunk, so the client can
+        decode each chunk as soon as it arrives.
+    """
+    wbits = zlib.MAX_WBITS | 16 if coding == 'gzip' else zlib.MAX_WBITS
+    compressor = zlib.compressobj(6, zlib.DEFLATED, wbits)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if flush:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
 def make_app(*args, **kw):
     '''
     Assembles basic WSGI-compatible application providing functionality of git-http-backend.
@@ -116,31 +334,52 @@ def make_app(*args, **kw):
     return selector
 
 class JSONServer(StaticWSGIServer):
+    gzip_response = GRIT_GZIP_RESPONSE
+
+    def encoding(self, environ):
+        """:return: Content coding negotiated with the client, or None"""
+        if self.gzip_response:
+            return accept_encoding(environ)
 
     def error_response(self, error, environ, start_response):
         headerbase = [('Content-Type', 'text/plain')]
-        start_response(self.canned_collection['400'], headerbase)
         d = {}
         d['success'] = False
         d['failure'] = True
         d['data'] = {'msg': error}
         _ret = json.dumps(d)
         log.debug('ERROR: %s' % _ret)
-        return _ret
+        headerbase.append(('Content-Length', str(len(_ret))))
+        start_response(self.canned_collection['400'], headerbase)
+        return [_ret]
+
+    def add_url(self, item, url):
+        """Adds the url of a listed element that has a path."""
+        if isinstance(item, dict) and not item.get('url') and 'path' in item:
+            path = item['path']
+            root = os.path.abspath(self.content_path)
+            if path.startswith(root + os.sep):
+                # repos are listed by filesystem path
+                parts = urlparse.urlsplit(url)
+                path = path[len(root):].replace(os.sep, '/')
+                item['url'] = '%s://%s%s' % (parts.scheme, parts.netloc, path)
+            else:
+                item['url'] = os.path.join(url, path)
+        return item
 
-    def json_response(self, data, environ, start_response):
-        headerbase = [('Content-Type', 'text/plain')]
-        start_response(self.canned_collection['200'], headerbase)
+    def json_response(self, data, environ, start_response, headers=[], url=None):
+        headerbase = [('Content-Type', 'text/plain')] + headers
 
         d = {}
         d['success'] = True
         d['failure'] = False
 
         try:
-            if type(data) == list:
+            if isinstance(data, types.GeneratorType):
+                data = list(data)
+            if type(data) == list and url:
                 for item in data:
-                    if not item.get('url'):
-                        item['url'] = os.path.join(self.url, item.get('path', str(item)))
+                    self.add_url(item, url)
 
             d['data'] = data
             _ret = json.dumps(d)
@@ -148,26 +387,187 @@ class JSONServer(StaticWSGIServer):
         except Exception, e:
             return self.error_response(str(e), environ, start_response)
 
-        return _ret
+        coding = self.encoding(environ)
+        if coding and len(_ret) >= GRIT_GZIP_MIN_SIZE:
+            _ret = ''.join(compress([_ret], coding))
+            headerbase.append(('Content-Encoding', coding))
+        if self.gzip_response:
+            headerbase.append(('Vary', 'Accept-Encoding'))
+        headerbase.append(('Content-Length', str(len(_ret))))
+        start_response(self.canned_collection['200'], headerbase)
+        return [_ret]
 
-    def get_params(self, environ):
-        kwargs = {}
-        params = urlparse.parse_qs(environ.get('wsgi.input').read())
-        action = params.get('action', ['read'])[0]
-        xaction = params.get('xaction', ['read'])[0]
+    def stream_response(self, data, environ, start_response, headers=[], url=None):
+        """
+        Sends a list response while it is being generated, encoding one
+        element at a time. There is no Content-Length, so HTTP/1.1 clients
+        get it with chunked transfer-encoding. When the client accepts it, the body
+        is compressed on the fly, flushing after each batch of elements.
+
+        The data array comes first, followed by the success flags, so an
+        error raised while generating the list is reported at the end.
+        """
+        if not isinstance(data, (list, types.GeneratorType)):
+            return self.json_response(data, environ, start_response, headers, url)
+        headers = [('Content-Type', 'text/plain')] + headers
+        body = self._stream(data, url)
+        coding = self.encoding(environ)
+        if coding:
+            headers.append(('Content-Encoding', coding))
+            body = compress(body, coding, flush=True)
+        if self.gzip_response:
+            headers.append(('Vary', 'Accept-Encoding'))
+        start_response(self.canned_collection['200'], headers)
+        return body
+
+    def _stream(self, data, url):
+        buf, size = ['{"data": ['], 0
         try:
-            del params['action']
-            del params['xaction']
-        except:
-            pass
+            for i, item in enumerate(data):
+                chunk = json.dumps(self.add_url(item, url))
+                if i:
+                    chunk = ', ' + chunk
+                buf.append(chunk)
+                size += len(chunk)
+                if size >= self.bufsize:
+                    yield ''.join(buf)
+                    buf, size = [], 0
+            buf.append('], "success": true, "failure": false}')
+        except Exception, e:
+            log.exception('stream error')
+            buf.append('], "success": false, "failure": true, "msg": %s}' % json.dumps(str(e)))
+        yield ''.join(buf)
+
+    def get_params(self, environ):
+        """
+        Returns the action and kwargs of a request. The body is either a JSON
+        object, or form encoded with JSON encoded values, except for the
+        RAW_PARAMS, e.g. file data, which are kept as sent.
+
+        :raise: ValueError if a JSON body cannot be decoded.
+        """
+        body = environ.get('wsgi.input').read()
+        if environ.get('CONTENT_TYPE', '').startswith('application/json'):
+            params = json.loads(body or '{}')
+            if not isinstance(params, dict):
+                raise ValueError('Request body must be a JSON object')
+            params = dict([(str(k), v) for k, v in params.items()])
+        else:
+            params = dict([(k, v[0] if k in RAW_PARAMS else decode_param(v[0]))
+                           for k, v in urlparse.parse_qs(body, keep_blank_values=True).items()])
+        action = str(params.pop('action', 'read'))
+        params.pop('xaction', None)
+        return action, params
+
+    handlers = {
+        'read': handle_read,
+        'new': handle_branch,
+        'branch': handle_branch,
+        'repos': handle_repos,
+        'items': handle_items,
+        'versions': handle_versions,
+        'submodules': handle_submodules,
+        'addSubmodule': handle_addSubmodule,
+        'addVersion': handle_addVersion,
+        'parent': handle_parent,
+        'upload': handle_upload,
+    }
+
+    def resolve(self, full_path):
+        """
+        Returns the pooled repo handle for a path, and the path of the item
+        in the repo it points to, if any.
+
+        :param full_path: Filesystem path.
+
+        :return: Tuple of (Local or path, item path).
+        """
+        repo = get_repo_parent(full_path, pool=repo_pool)
+        if repo is None:
+            repo = full_path
+        item_path = full_path.split(str(repo))[-1][1:]
+        return repo, item_path
+
+    def dispatch(self, repo, cmd, kwargs, item_path='', url=None):
+        """
+        Runs an action on a repo, or on the item at item_path in the repo.
+
+        :param repo: Local instance or path.
+        :param cmd: Action name.
+        :param kwargs: Action kwargs.
+        :param item_path: Item path in the repo.
+        :param url: Request url. Listed elements get their urls before the
+            requested fields are projected, so they keep them without the
+            path field.
+
+        :return: Action result.
+        """
+        fields = parse_fields(kwargs.get('fields'))
+        if url and fields and 'path' not in fields:
+            kwargs['fields'] = fields + ['path']
+            data = self.dispatch(repo, cmd, kwargs, item_path)
+            def project(item):
+                item = self.add_url(item, url)
+                if isinstance(item, dict):
+                    item.pop('path', None)
+                return item
+            if isinstance(data, list):
+                return [project(item) for item in data]
+            if isinstance(data, types.GeneratorType):
+                return (project(item) for item in data)
+            return data
+
+        #HACK: get the item, swap with repo
+        if item_path and cmd != 'submodules':
+            log.debug('repo: %s, item_path: %s' % (repo, item_path))
+            item = next(repo.iteritems(path=item_path), None)
+            if item:
+                repo = item
+        func = self.handlers.get(cmd, None)
+        if func:
+            return func(repo, **kwargs)
+        return getattr(repo, cmd)(**kwargs)
+
+    def batch(self, full_path, url, actions=()):
+        """
+        Runs a list of actions in one request. Repo handles are shared
+        between the actions, and with other requests, through the repo pool.
 
-        for k,v in params.items():
+        :param full_path: Filesystem path of the request.
+        :param url: Request url.
+        :param actions: List of dicts with the action name, an optional
+            path relative to the request path, and the action kwargs.
+
+        :return: List of results with success and failure flags, and the
+            action data or an error message.
+        """
+        results = []
+        for params in actions:
+            params = dict([(str(k), v) for k, v in params.items()])
+            cmd = str(params.pop('action', 'read'))
+            path, action_url = full_path, url
+            rel = params.pop('path', None)
+            if rel:
+                rel = rel.strip('/')
+                path = os.path.abspath(os.path.join(full_path, rel))
+                action_url = '%s/%s' % (url.rstrip('/'), rel)
             try:
-                kwargs[k] = eval(params[k][0])
+                if cmd in ('data', 'batch'):
+                    raise ValueError('Action cannot be batched: %s' % cmd)
+                if not is_inside(path, self.content_path):
+                    raise ValueError('Forbidden path: %s' % rel)
+                repo, item_path = self.resolve(path)
+                data = self.dispatch(repo, cmd, params, item_path, action_url)
+                if isinstance(data, types.GeneratorType):
+                    data = list(data)
+                if type(data) == list:
+                    for item in data:
+                        self.add_url(item, action_url)
+                results.append({'success': True, 'failure': False, 'data': data})
             except Exception, e:
-                kwargs[k] = params[k][0]
-
-        return action, kwargs
+                log.debug('batch error: %s' % e)
+                results.append({'success': False, 'failure': True, 'data': {'msg': str(e)}})
+        return results
 
     def __call__(self, environ, start_response):
 
@@ -179,67 +579,48 @@ class JSONServer(StaticWSGIServer):
 
         scheme = environ.get('wsgi.url_scheme', 'http')
         host = environ.get('HTTP_HOST', 'localhost').decode('utf8')
-        self.url = '%s://%s/%s' %(scheme, host, path_info)
+        url = '%s://%s/%s' %(scheme, host, path_info.lstrip('/'))
 
         full_path = os.path.abspath(os.path.join(self.content_path, path_info.strip('/')))
         _pp = os.path.abspath(self.content_path)
 
-        cmd, kwargs = self.get_params(environ)
+        try:
+            cmd, kwargs = self.get_params(environ)
+        except ValueError, e:
+            return self.error_response(str(e), environ, start_response)
+        stream = kwargs.pop('stream', False)
 
-        if not full_path.startswith(_pp):
+        if not is_inside(full_path, _pp):
             log.error('forbidden: %s' % full_path)
             return self.canned_handlers(environ, start_response, 'forbidden')
 
-        if os.path.exists(full_path):
-            mtime = os.stat(full_path).st_mtime
-            etag, last_modified =  str(mtime), email.utils.formatdate(mtime)
-        else:
-            mtime, etag, last_modified = (None, None, None)
+        repo, item_path = self.resolve(full_path)
 
-        headers = [
-            ('Content-type', 'text/plain'),
-            ('Date', email.utils.formatdate(time.time())),
-            ('Last-Modified', last_modified),
-            ('ETag', etag)
-        ]
-
-        fmap = {
-            'read': handle_read,
-            'new': handle_branch,
-            'branch': handle_branch,
-            'repos': handle_repos,
-            'items': handle_items,
-            'versions': handle_versions,
-            'submodules': handle_submodules,
-            'addSubmodule': handle_addSubmodule,
-            'addVersion': handle_addVersion,
-            'parent': handle_parent,
-            'upload': handle_upload,
-        }
-
-        repo = get_repo_parent(full_path)
-        if repo is None:
-            repo = full_path
-        item_path = full_path.split(str(repo))[-1][1:]
-
-        #HACK: get the item, swap with repo
-        if item_path and cmd != 'submodules':
-            log.debug('full_path: %s, item_path: %s' % (full_path, item_path))
-            items = repo.items(path=item_path)
-            if items:
-                repo = item = items[0]
+        # read only actions can be revalidated by the client
+        headers = []
+        if cmd in CACHEABLE and isinstance(repo, Local):
+            etag = repo_etag(repo, url, cmd, json.dumps(kwargs, sort_keys=True),
+                             self.encoding(environ) or '')
+            if etag_matches(environ, etag):
+                start_response(self.canned_collection['304'], [('ETag', etag)])
+                return ['']
+            headers.append(('ETag', etag))
 
         if cmd == 'data':
-            data = repo.file()
-            return self.package_response(data, environ, start_response)
-
+            item = repo.getItem(item_path) if item_path else None
+            if not is_blob(item):
+                return self.error_response('No such file: %s' % item_path,
+                                           environ, start_response)
+            data, size = open_item(item)
+            return self.package_response(data, environ, start_response,
+                                         [('Content-Length', str(size))])
+        elif cmd == 'batch':
+            response = self.batch(full_path, url, kwargs.get('actions', ()))
         else:
-            func = fmap.get(cmd, None)
-            if func:
-                response = func(repo, **kwargs)
-            else:
-                response = getattr(repo, cmd)(**kwargs)
-        return self.json_response(response, environ, start_response)
+            response = self.dispatch(repo, cmd, kwargs, item_path, url)
+        if stream:
+            return self.stream_response(response, environ, start_response, headers, url)
+        return self.json_response(response, environ, start_response, headers, url)
 
 class StaticServer(StaticWSGIServer):
     def __init__(self, *args, **kwargs):
@@ -251,9 +632,45 @@ class StaticServer(StaticWSGIServer):
         return super(StaticServer, self).__call__(environ, start_response)
 
 class FileServer(StaticWSGIServer):
+    gzip_response = GRIT_GZIP_RESPONSE
+
     def __init__(self, *args, **kwargs):
         super(FileServer, self).__init__(*args, **kwargs)
 
+    def range_response(self, outIO, ranges, size, environ, start_response, headers=[]):
+        """
+        Sends the requested byte ranges of outIO as 206 Partial Content, as a
+        multipart/byteranges body when more than one range was requested.
+        """
+        headersIface = Headers(list(headers))
+        if len(ranges) == 1:
+            first, last = ranges[0]
+            headersIface['Content-Range'] = 'bytes %d-%d/%d' % (first, last, size)
+            headersIface['Content-Length'] = str(last - first + 1)
+            start_response(self.canned_collection['206'], headersIface.items())
+            return iter_range(outIO, first, last, self.bufsize)
+
+        boundary = uuid.uuid4().hex
+        content_type = headersIface['Content-type'] or 'application/octet-stream'
+        parts = ['--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n'
+                 % (boundary, content_type, first, last, size) for first, last in ranges]
+        end = '\r\n--%s--\r\n' % boundary
+        length = sum([len(p) + last - first + 1 for p, (first, last) in zip(parts, ranges)])
+        length += 2 * (len(parts) - 1) + len(end)
+        headersIface['Content-type'] = 'multipart/byteranges; boundary=%s' % boundary
+        headersIface['Content-Length'] = str(length)
+        start_response(self.canned_collection['206'], headersIface.items())
+
+        def body():
+            for i, (first, last) in enumerate(ranges):
+                if i:
+                    yield '\r\n'
+                yield parts[i]
+                for data in iter_range(outIO, first, last, self.bufsize):
+                    yield data
+            yield end
+        return body()
+
     def __call__(self, environ, start_response):
 
         selector_matches = (environ.get('wsgiorg.routing_args') or ([],{}))[1]
@@ -263,20 +680,63 @@ class FileServer(StaticWSGIServer):
             path_info = environ.get('PATH_INFO', '').decode('utf8')
 
         full_path = os.path.abspath(os.path.join(self.content_path, path_info.strip('/')))
-        repo = get_repo_parent(full_path)
+        repo = get_repo_parent(full_path, pool=repo_pool)
         item_path = full_path.split(str(repo))[-1][1:]
 
         # look for the item in the repo
-        items = repo.items(path=item_path)
+        item = repo.getItem(item_path)
 
         # return file-like object
-        if items:
-            file_like = items[0].file()
+        if is_blob(item):
+            content_type = mimetypes.guess_type(item.name)[0] or 'application/octet-stream'
+
+            # byte ranges are served from the uncompressed data
+            coding = None
+            if self.gzip_response and is_compressible(content_type) \
+                    and not environ.get('HTTP_RANGE'):
+                coding = accept_encoding(environ)
+
+            # blob shas are strong etags, so no need to read the data
+            etag = '"%s"' % item.id
+            if coding:
+                etag = '"%s-%s"' % (item.id, coding)
+            if etag_matches(environ, etag):
+                start_response(self.canned_collection['304'], [('ETag', etag)])
+                return ['']
+            file_like, size = open_item(item)
+            headers = [
+                ('Content-type', content_type),
+                ('Accept-Ranges', 'bytes'),
+                ('ETag', etag),
+            ]
+            if self.gzip_response and is_compressible(content_type):
+                headers.append(('Vary', 'Accept-Encoding'))
+            if coding and size >= GRIT_GZIP_MIN_SIZE:
+                headers.append(('Content-Encoding', coding))
+                file_like.seek(0)
+                body = compress(iter(lambda: file_like.read(self.bufsize), ''), coding)
+                return self.package_response(body, environ, start_response, headers)
+
+            # partial content, unless If-Range names another version
+            header = environ.get('HTTP_RANGE')
+            if header and environ.get('HTTP_IF_RANGE', etag) == etag:
+                ranges = parse_range(header, size)
+                if ranges == []:
+                    start_response(self.canned_collection['416'],
+                                   [('Content-Range', 'bytes */%d' % size)])
+                    return ['']
+                if ranges:
+                    return self.range_response(file_like, ranges, size, environ,
+                                               start_response, headers)
+            headers.append(('Content-Length', str(size)))
         else:
             default = os.path.join(GRIT_STATIC_DIR, os.path.basename(item_path))
+            if not os.path.isfile(default):
+                return self.canned_handlers(environ, start_response, 'not_found')
             file_like = open(default, 'rb')
+            headers = []
 
-        return self.package_response(file_like, environ, start_response)
+        return self.package_response(file_like, environ, start_response, headers)
 
 class UIServer(StaticWSGIServer):
     def __init__(self, *args, **kwargs):
@@ -23,21 +23,43 @@ def is_git_dir(d):
                 os.readlink(headref).startswith('refs'))
     return False
 
+def ref_stamp(d, ref='refs/heads/master'):
+    """
+    Returns a cheap fingerprint of a ref that changes whenever the ref is
+    updated, taken from the loose ref file or packed-refs if there is none.
+
+    :param d: Git dir.
+    :param ref: Ref name.
+
+    :return: Tuple of (path, mtime, size, inode) or None.
+    """
+    for name in (ref, 'packed-refs'):
+        path = os.path.join(d, name)
+        try:
+            st = os.stat(path)
+            return (path, st.st_mtime, st.st_size, st.st_ino)
+        except OSError:
+            continue
+    return None
+
 def is_tree(mode):
     if mode is None:
         return False
     return stat.S_ISDIR(mode)
 
-def serialize(d):
+def serialize(d, fields=None):
     """
     Attempts to serialize values from a dictionary, 
     skipping private attrs.
 
     :param d: A dictionary of params to serialize, 
             typically cls.__dict__
+    :param fields: Optional list of the keys to serialize.
     """
     ret = {}
     for k,v in d.items():
+        if fields is not None and k not in fields:
+            continue
         if not k.startswith('_'):
             ret[k] = str(d[k])
     #ret['__class__'] = obj.__class__.__name__
@@ -25,6 +25,22 @@ class BasicTests(unittest.TestCase):
         # cleanup
         self.repo.delete()
 
+    def _serve(self):
+        """:return: Tuple of (running Server, url of the test repo)"""
+        import socket
+        import threading
+        sock = socket.socket()
+        sock.bind(('localhost', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        server = Server(base_dir=os.path.dirname(self.tempdir), port=port)
+        thread = threading.Thread(target=server.start)
+        thread.daemon = True
+        thread.start()
+        while not server.ready:
+            time.sleep(0.1)
+        return server, 'http://localhost:%d/%s' % (port, self.repo.name)
+
     def test_set_desc(self):
         # test setting the description
         desc = 'unit test for ' + self.repo.name
@@ -38,18 +54,219 @@ class BasicTests(unittest.TestCase):
         v.save('add version test')
         self.assertEqual(len(self.repo.versions()), n+1)
 
+    def test_commit_graph(self):
+        # test the commit graph is persisted and extended
+        from grit import Local
+        v = self.repo.addVersion()
+        v.save('commit graph test')
+        local = Local(self.repo.path)
+        self.assertEqual(local._commits()[-1].id, v.id)
+        self.assertEqual(len(local._graph), 2)
+        v = self.repo.addVersion()
+        v.save('commit graph test')
+        self.assertEqual(local._commits()[-1].id, v.id)
+        self.assertEqual(len(Local(self.repo.path)._graph.update()), 3)
+
+    def test_version_index(self):
+        # test version numbers map to commits both ways
+        v = self.repo.addVersion()
+        v.save('version index test')
+        self.assertEqual(self.repo.versions(1).id, v.id)
+        self.assertEqual(self.repo.versions(-1).version, 1)
+        self.assertEqual(self.repo.versions(0).version, 0)
+        self.assertEqual(self.repo.addVersion().version, None)
+
+    def test_lazy_versions(self):
+        # test slicing and indexing the versions sequence
+        for i in range(3):
+            self.repo.addVersion().save('lazy versions test %d' % i)
+        versions = self.repo.versions()
+        self.assertEqual(len(versions), 4)
+        self.assertEqual(len(versions[1:]), 3)
+        self.assertEqual(versions[-1].id, self.repo.versions(-1).id)
+        self.assertEqual([v.version for v in versions[-2:]], [2, 3])
+
+    def test_head_version(self):
+        # test the head version is reused until the ref changes
+        from grit import Local
+        local = Local(self.repo.path)
+        head = local._head()
+        self.assertTrue(local._head() is head)
+        v = local.addVersion()
+        v.save('head version test')
+        self.assertEqual(local._head().id, v.id)
+        self.assertEqual(local.message, 'head version test')
+
+    def test_repo_pool(self):
+        # test pooled handles are reused and follow ref changes
+        from grit import RepoPool
+        pool = RepoPool(size=1)
+        local = pool.get(self.repo.path)
+        self.assertTrue(pool.get(self.repo.path) is local)
+        self.repo.addFile(test_file, 'adding test file')
+        self.assertEqual(len(pool.get(self.repo.path).items()), 1)
+        self.assertEqual(pool.get(self.repo.path).serialize()['comment'], 'adding test file')
+        b = self.repo.branch('branch')
+        self.assertTrue(pool.get(b.path + '/') is pool.get(b.path))
+        self.assertFalse(pool.get(self.repo.path) is local)
+
+    def test_repo_resolver(self):
+        # test paths resolve to the nearest known repo
+        from grit import RepoResolver, get_repo_parent
+        resolver = RepoResolver()
+        self.assertEqual(resolver.resolve(self.repo.path), None)
+        resolver.add(self.repo.path)
+        b = self.repo.branch('branch')
+        item_path = os.path.join(b.path, 'a', 'b.jpg')
+        self.assertEqual(resolver.resolve(item_path), b.path)
+        resolver.remove(b.path)
+        self.assertEqual(resolver.resolve(item_path), self.repo.path)
+        self.assertEqual(get_repo_parent(item_path).path, b.path)
+        b.delete()
+        self.assertEqual(get_repo_parent(item_path).path, self.repo.path)
+        # branches made by another process show up once the dir changes
+        resolver = RepoResolver()
+        resolver.add(self.repo.path)
+        self.assertEqual(resolver.resolve(item_path), self.repo.path)
+        time.sleep(1)
+        os.system('"%s" -c "import sys; sys.path.insert(0, %r); from grit import Local; '
+                  'Local(%r).branch(%r)"' % (sys.executable, path, self.repo.path, 'branch'))
+        self.assertEqual(resolver.resolve(item_path), b.path)
+
     def test_add_item(self):
         # test adding an item
         self.assertEqual(len(self.repo.items()), 0)
         self.repo.addFile(test_file, 'adding test file')
         self.assertEqual(len(self.repo.items()), 1)
 
+    def test_incremental_save(self):
+        # test carried over blobs are not read when saving
+        self.repo.addFile(test_file, 'adding test file')
+        v = self.repo.addVersion()
+        self.assertEqual(v.tree.newItems(), [])
+        v.save('incremental save test')
+        item = v.tree.items()[0]
+        self.assertEqual(item._Item__blob, None)
+        self.assertEqual(len(self.repo.items()), 1)
+
+    def test_add_items_pack(self):
+        # test a bulk publish writes one pack file, small ones stay loose
+        from grit import Local, Item
+        from grit.cfg import GRIT_UNPACK_LIMIT
+        local = Local(self.repo.path)
+        pack_dir = os.path.join(local.git_dir, 'objects', 'pack')
+        local.addItems([Item.from_string(repo=local, name='small.txt', string='small')])
+        self.assertEqual([p for p in os.listdir(pack_dir) if p.endswith('.pack')], [])
+        items = [Item.from_string(repo=local, name='item%d.txt' % i, string=str(i))
+                 for i in range(GRIT_UNPACK_LIMIT)]
+        local.addItems(items, 'bulk publish test')
+        packs = [p for p in os.listdir(pack_dir) if p.endswith('.pack')]
+        self.assertEqual(len(packs), 1)
+        mode = os.stat(os.path.join(pack_dir, packs[0])).st_mode
+        self.assertEqual(mode & 0444, 0444)
+        self.assertEqual(len(local.items()), GRIT_UNPACK_LIMIT + 1)
+        self.assertEqual(local.items('item3.txt')[0].data(), '3')
+
+    def test_stream_item(self):
+        # test large files are streamed into the object store
+        from grit.repo import version
+        size, version.GRIT_STREAM_SIZE = version.GRIT_STREAM_SIZE, 0
+        try:
+            item = Item.from_path(repo=self.repo, path=test_file)
+        finally:
+            version.GRIT_STREAM_SIZE = size
+        self.assertEqual(item._Item__blob, None)
+        self.repo.addItem(item, 'adding streamed file')
+        self.assertEqual(self.repo.items()[0].data(), open(test_file, 'rb').read())
+
+    def test_stream_checkout(self):
+        # test items are read back through the streaming blob reader
+        self.repo.addFile(test_file, 'adding test file')
+        item = self.repo.items()[0]
+        data = open(test_file, 'rb').read()
+        f = item.file()
+        self.assertEqual(f.size, len(data))
+        f.seek(1000)
+        self.assertEqual(f.read(100), data[1000:1100])
+        path = os.path.join(tempfile.gettempdir(), 'grit-unittest-checkout')
+        item.checkout(path)
+        self.assertEqual(open(path, 'rb').read(), data)
+        os.remove(path)
+
+    def test_blob_cache(self):
+        # test blob data is served from plain cache files
+        from grit.server.cache import BlobCache
+        self.repo.addFile(test_file, 'adding test file')
+        item = self.repo.items()[0]
+        data = open(test_file, 'rb').read()
+        cache = BlobCache(os.path.join(self.tempdir, 'cache'), len(data) + 10)
+        store = self.repo.object_store
+        self.assertEqual(cache.open(store, item.id).read(), data)
+        f = cache.open(store, item.id)
+        self.assertTrue(hasattr(f, 'fileno'))
+        self.assertEqual(f.read(), data)
+        self.assertFalse(hasattr(BlobCache(os.path.join(self.tempdir, 'small'), 10).open(store, item.id), 'fileno'))
+        blob = Item.from_string(repo=self.repo, name='small.txt', string='x' * 20)
+        self.repo.addItem(blob, 'adding small file')
+        cache.open(store, blob.id)
+        self.assertFalse(os.path.exists(cache._path(item.id)))
+        self.assertEqual(os.stat(cache.path).st_mode & 0777, 0700)
+        shared = os.path.join(self.tempdir, 'shared')
+        os.mkdir(shared)
+        os.chmod(shared, 0777)
+        self.assertFalse(hasattr(BlobCache(shared).open(store, item.id), 'fileno'))
+        from grit.server.server import is_blob
+        self.assertTrue(is_blob(self.repo.getItem(item.path)))
+        self.assertFalse(is_blob(self.repo.getItem('missing.txt')))
+        self.assertFalse(is_blob(self.repo))
+
+    def test_range(self):
+        # test byte ranges are parsed and read from the blob
+        from grit.server.server import parse_range, iter_range
+        self.repo.addFile(test_file, 'adding test file')
+        data = open(test_file, 'rb').read()
+        size = len(data)
+        self.assertEqual(parse_range('bytes=0-99,-100', size), [(0, 99), (size-100, size-1)])
+        self.assertEqual(parse_range('bytes=%d-' % size, size), [])
+        self.assertEqual(parse_range('bytes=9-0', size), None)
+        self.assertEqual(parse_range('bytes=-100,50-99,0-59,100-199', size),
+                         [(0, 199), (size-100, size-1)])
+        self.assertEqual(parse_range('bytes=' + ','.join(['0-0'] * 100), size), None)
+        f = self.repo.items()[0].file()
+        self.assertEqual(''.join(iter_range(f, 1000, 1099, 7)), data[1000:1100])
+
+    def test_etag(self):
+        # test file downloads are revalidated by blob sha
+        from grit.server.server import FileServer
+        self.repo.addFile(test_file, 'adding test file')
+        server = FileServer(content_path=os.path.dirname(self.tempdir))
+        responses = []
+        start_response = lambda status, headers: responses.append((status, dict(headers)))
+        environ = {'PATH_INFO': '/%s/puppy.jpg' % self.repo.name}
+        data = ''.join(server(dict(environ), start_response))
+        self.assertEqual(data, open(test_file, 'rb').read())
+        etag = responses[-1][1]['ETag']
+        self.assertEqual(etag, '"%s"' % self.repo.getItem('puppy.jpg').id)
+        environ['HTTP_IF_NONE_MATCH'] = etag
+        self.assertEqual(''.join(server(environ, start_response)), '')
+        self.assertTrue(responses[-1][0].startswith('304'))
+
     def test_find_item(self):
         # test finding by name
         self.assertEqual(len(self.repo.items(os.path.basename(test_file))), 0)
         self.repo.addFile(test_file, 'adding test file')
         self.assertEqual(len(self.repo.items(os.path.basename(test_file))), 1)
 
+    def test_get_item(self):
+        # test exact and regex lookups through the tree index
+        name = os.path.basename(test_file)
+        self.repo.addFile(test_file, 'adding test file')
+        version = self.repo.versions(-1)
+        self.assertEqual(version.getItem(name).path, name)
+        self.assertEqual(version.getItem('missing.jpg'), None)
+        self.assertEqual(len(version.items('pup.*')), 1)
+        self.assertEqual(len(version.items('dog.*')), 0)
+
     def test_remove_item(self):
         # test removing items from a version
         v = self.repo.addVersion()
@@ -68,6 +285,272 @@ class BasicTests(unittest.TestCase):
         self.repo.addFile(test_file, 'adding test file')
         self.assertEqual(len(b.items()), 1)
 
+    def test_branch_iteritems(self):
+        # test branch items override inherited items
+        b = self.repo.branch('branch')
+        self.repo.addFile(test_file, 'adding test file')
+        b.addFile(test_file, 'adding test file to branch')
+        items = list(b.iteritems())
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0].repo.path, b.path)
+        item = next(b.iteritems(path=os.path.basename(test_file)))
+        self.assertEqual(item.id, items[0].id)
+        self.assertEqual(b.getItem(os.path.basename(test_file)).id, item.id)
+        self.assertEqual(b.getItem('puppy.jpgx'), None)
+        # resolved without the view after a publish up the chain
+        self.repo.addItem(Item.from_string(repo=self.repo, name='new.txt', string='new'))
+        self.assertEqual(b.getItem('new.txt').repo.path, self.repo.path)
+        self.assertEqual(b.getItem(os.path.basename(test_file)).repo.path, b.path)
+
+    def test_resolved_view(self):
+        # test the branch view is reused until a head in the chain moves
+        b = self.repo.branch('branch')
+        view = b._view()[1]
+        self.assertTrue(b._view()[1] is view)
+        self.repo.addFile(test_file, 'adding test file')
+        self.assertFalse(b._view()[1] is view)
+        self.assertEqual(len(b._view()[1]), 1)
+
+    def test_paging(self):
+        # test json handlers return the requested window and fields
+        from grit import Local
+        from grit.server.handler import handle_items, handle_versions, handle_repos
+        local = Local(self.repo.path)
+        local.addItems([Item.from_string(repo=local, name='item%d.txt' % i, string=str(i))
+                        for i in range(5)], 'paging test')
+        items = list(handle_items(local, offset=1, limit=2, fields='name,path'))
+        self.assertEqual([i['name'] for i in items], ['item1.txt', 'item2.txt'])
+        self.assertEqual(sorted(items[0].keys()), ['name', 'path'])
+        versions = list(handle_versions(local, offset=1, fields=['name']))
+        self.assertEqual(versions, [{'name': local.versions(-1).id}])
+        # negative offsets count from the end
+        versions = list(handle_versions(local, offset=-1, limit=1, fields=['name']))
+        self.assertEqual(versions, [{'name': local.versions(-1).id}])
+        items = list(handle_items(local, offset=-2, fields='name'))
+        self.assertEqual([i['name'] for i in items], ['item3.txt', 'item4.txt'])
+        items = list(handle_items(local, offset=-3, limit=1, fields='name'))
+        self.assertEqual([i['name'] for i in items], ['item2.txt'])
+        self.assertRaises(ValueError, handle_items, local, limit=-1)
+        local.branch('branch')
+        self.assertEqual(handle_repos(local, fields='name'), [{'name': 'branch'}])
+        self.assertEqual(handle_repos(local, offset=1), [])
+        self.assertEqual(handle_repos(local, offset=-1, limit=1, fields='name'), [{'name': 'branch'}])
+
+    def test_stream_response(self):
+        # test listings are streamed as one json document
+        import simplejson as json
+        from grit.server.server import JSONServer
+        server = JSONServer(content_path=self.tempdir, bufsize=10)
+        items = ({'path': 'item%d.txt' % i} for i in range(5))
+        d = json.loads(''.join(server._stream(items, 'http://localhost/repo')))
+        self.assertTrue(d['success'])
+        self.assertEqual(d['data'][4]['url'], 'http://localhost/repo/item4.txt')
+        def fail():
+            yield {'path': 'item.txt'}
+            raise RepoError('failed')
+        from grit.exc import RepoError
+        d = json.loads(''.join(server._stream(fail(), 'http://localhost/repo')))
+        self.assertTrue(d['failure'])
+        self.assertEqual(len(d['data']), 1)
+
+    def test_params(self):
+        # test request params are decoded as json, not evaluated
+        from StringIO import StringIO
+        from grit.server.server import JSONServer
+        server = JSONServer(content_path=self.tempdir)
+        environ = {'wsgi.input': StringIO('action=items&limit=2&fields=%5B%22name%22%5D'
+                                          '&desc=__import__%28%27os%27%29&bare=True')}
+        action, kwargs = server.get_params(environ)
+        self.assertEqual(action, 'items')
+        self.assertEqual(kwargs, {'limit': 2, 'fields': ['name'], 'bare': True,
+                                  'desc': "__import__('os')"})
+        environ = {'wsgi.input': StringIO('{"action": "versions", "offset": 1}'),
+                   'CONTENT_TYPE': 'application/json'}
+        self.assertEqual(server.get_params(environ), ('versions', {'offset': 1}))
+
+    def test_upload(self):
+        # test binary file data is uploaded through a proxy as is
+        from grit import Proxy
+        data = open(test_file, 'rb').read()
+        server, url = self._serve()
+        try:
+            Proxy(url).upload(filename='puppy.jpg', filedata=data)
+        finally:
+            server.stop()
+        self.assertEqual(self.repo.getItem('puppy.jpg').data(), data)
+
+    def test_batch(self):
+        # test several actions run in one request
+        from grit.server.server import JSONServer
+        self.repo.addFile(test_file, 'adding test file')
+        self.repo.branch('branch')
+        server = JSONServer(content_path=os.path.dirname(self.tempdir))
+        results = server.batch(self.tempdir, 'http://localhost/' + self.repo.name, actions=[
+            {'action': 'read', 'path': 'puppy.jpg'},
+            {'action': 'items', 'path': 'branch', 'fields': ['name']},
+            {'action': 'data'},
+            {'action': 'read', 'path': '../..'},
+            {'action': 'read', 'path': '../../%s2' % os.path.basename(os.path.dirname(self.tempdir))},
+        ])
+        self.assertEqual(results[0]['data']['name'], 'puppy.jpg')
+        self.assertEqual(results[1]['data'][0]['name'], 'puppy.jpg')
+        self.assertEqual(results[1]['data'][0], {'name': 'puppy.jpg',
+                         'url': 'http://localhost/%s/branch/puppy.jpg' % self.repo.name})
+        self.assertEqual([r['success'] for r in results], [True, True, False, False, False])
+        self.assertEqual(results[4]['data']['msg'][:15], 'Forbidden path:')
+
+    def test_connection_pool(self):
+        # test requests share a connection, and only reads are sent again
+        import httplib
+        import threading
+        import BaseHTTPServer
+        import SocketServer
+        from grit.repo.proxy import ConnectionPool
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                self.server.calls.append(self.client_address)
+                if self.server.drop:
+                    # close without answering, like a server dropping an idle connection
+                    self.server.drop -= 1
+                    self.close_connection = 1
+                    return
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write('ok')
+            def log_message(self, *args):
+                pass
+        class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+        server = HTTPServer(('localhost', 0), Handler)
+        server.calls, server.drop = [], 0
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        pool = ConnectionPool()
+        url = 'http://localhost:%d/repo' % server.server_port
+        try:
+            for i in range(3):
+                self.assertEqual(pool.request('POST', url, 'x')[2], 'ok')
+            self.assertEqual(len(set(server.calls)), 1)
+            server.drop = 1
+            self.assertRaises(httplib.BadStatusLine, pool.request, 'POST', url, 'x')
+            self.assertEqual(len(server.calls), 4)
+            pool.request('POST', url, 'x')
+            server.drop = 1
+            self.assertEqual(pool.request('POST', url, 'x', retry=True)[2], 'ok')
+            self.assertEqual(len(server.calls), 7)
+        finally:
+            pool.clear()
+            server.shutdown()
+            server.server_close()
+
+    def test_proxy_items(self):
+        # test listed proxies are built from the listing, without reading each
+        from grit import Proxy
+        from grit.repo import proxy
+        self.repo.addFile(test_file, 'adding test file')
+        self.repo.branch('branch')
+        server, url = self._serve()
+        requests = []
+        request = proxy.connection_pool.request
+        def count(*args, **kwargs):
+            requests.append(args)
+            return request(*args, **kwargs)
+        proxy.connection_pool.request = count
+        try:
+            repos = Proxy(url).repos()
+            self.assertEqual(len(requests), 2)
+            self.assertEqual([r.name for r in repos], ['branch'])
+            self.assertEqual(repos[0].url, url + '/branch')
+            self.assertEqual(repos[0].items()[0].name, 'puppy.jpg')
+            self.assertEqual(len(requests), 3)
+        finally:
+            proxy.connection_pool.request = request
+            server.stop()
+
+    def test_response_cache(self):
+        # test cached responses persist and etags follow repo changes
+        from grit.repo.proxy import ResponseCache
+        from grit.server.server import repo_etag
+        path = os.path.join(self.tempdir, 'responses')
+        cache = ResponseCache(path=path)
+        key = cache.key('http://localhost/repo', {'action': 'items'})
+        cache.set(key, '"abc"', '{"success": true}')
+        self.assertEqual(ResponseCache(path=path).get(key)[::2], ('"abc"', '{"success": true}'))
+        cache = ResponseCache(size=50)
+        cache.set('a', '"a"', 'x' * 20)
+        cache.set('b', '"b"', 'x' * 20)
+        cache.set('c', '"c"', 'x' * 100)
+        self.assertEqual(cache.get('c'), None)
+        cache.set('c', '"c"', 'x' * 20)
+        self.assertEqual([cache.get(k) is None for k in 'abc'], [True, False, False])
+        self.assertFalse(ResponseCache(size=0).enabled)
+        b = self.repo.branch('branch')
+        etag = repo_etag(b, 'items')
+        self.assertEqual(repo_etag(b, 'items'), etag)
+        self.repo.addFile(test_file, 'adding test file')
+        self.assertNotEqual(repo_etag(b, 'items'), etag)
+
+    def test_async_proxy(self):
+        # test fan-out results keep url order and failures do not raise
+        from grit import AsyncProxy
+        from grit.repo.proxy import ServerError
+        urls = ['http://localhost:1/repo%d' % i for i in range(5)]
+        results = AsyncProxy(workers=2, timeout=1).map(urls, 'versions')
+        self.assertEqual(len(results), len(urls))
+        for result in results:
+            self.assertTrue(isinstance(result, ServerError))
+        for i in range(5):
+            self.repo.branch('shot%d' % i)
+        server, url = self._serve()
+        try:
+            urls = [url + '/shot%d' % i for i in range(5)]
+            results = AsyncProxy(workers=3).map(urls[:2] + ['http://localhost:1/repo'] + urls[2:])
+            self.assertTrue(isinstance(results.pop(2), ServerError))
+            self.assertEqual([r.name for r in results], ['shot%d' % i for i in range(5)])
+            self.assertEqual([r.url for r in results], urls)
+            results = AsyncProxy(workers=3).gather([(url, 'repos', {'fields': ['name']}),
+                                                    (url + '/shot1', 'items', {})])
+            self.assertEqual(sorted([r.name for r in results[0]]), ['shot%d' % i for i in range(5)])
+            self.assertEqual(results[1], [])
+        finally:
+            server.stop()
+
+    def test_compression(self):
+        # test content coding negotiation and round trips through the proxy
+        from grit.server.server import accept_encoding, compress
+        from grit.repo.proxy import decode_body
+        self.assertEqual(accept_encoding({'HTTP_ACCEPT_ENCODING': 'deflate, gzip'}), 'gzip')
+        self.assertEqual(accept_encoding({'HTTP_ACCEPT_ENCODING': 'gzip;q=0, *'}), 'deflate')
+        self.assertEqual(accept_encoding({'HTTP_ACCEPT_ENCODING': 'identity'}), None)
+        self.assertEqual(accept_encoding({}), None)
+        data = open(test_file, 'rb').read()
+        chunks = [data[i:i+1000] for i in range(0, len(data), 1000)]
+        for coding in ('gzip', 'deflate'):
+            body = ''.join(compress(chunks, coding, flush=True))
+            self.assertEqual(decode_body(body, coding), data)
+
+    def test_repo_catalog(self):
+        # test repo listings follow new branches, commits and descriptions
+        from grit import RepoCatalog
+        catalog = RepoCatalog()
+        b = self.repo.branch('branch', desc='first')
+        repos = catalog.list(self.repo.path)
+        self.assertEqual([r['name'] for r in repos], ['branch'])
+        self.assertEqual(repos[0]['parent'], self.repo.name)
+        self.assertEqual(repos[0]['desc'], 'first')
+        time.sleep(1)
+        b.setDescription('second')
+        b.addFile(test_file, 'adding test file')
+        self.repo.branch('other')
+        repos = catalog.list(self.repo.path)
+        self.assertEqual([r['name'] for r in repos], ['branch', 'other'])
+        self.assertEqual(repos[0]['desc'], 'second')
+        self.assertEqual(repos[0]['head'], b.versions(-1).id)
+
     def test_del_branch(self):
         # test deleting branches
         from grit import get_repos